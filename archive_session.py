@@ -0,0 +1,127 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+DEFAULT_POOL_CONNECTIONS = 4    # Number of hosts to keep a connection pool for
+DEFAULT_POOL_MAXSIZE = 10       # Keep-alive connections kept per host
+DEFAULT_TIMEOUT = (10, 60)      # (connect, read) timeouts in seconds
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+class ConnectionStats():
+    """Thread-safe counters of requests made and TCP connections opened by an
+    ArchiveSession. Every request that did not open a new connection reused a
+    kept-alive one."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def request_made(self):
+        with self._lock:
+            self.requests += 1
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    @property
+    def connections_reused(self):
+        return max(self.requests - self.connections_opened, 0)
+
+    @property
+    def reuse_rate(self):
+        if self.requests == 0:
+            return 0.0
+        return self.connections_reused / self.requests
+
+    def summary(self):
+        return "{} requests, {} connections opened, {} reused ({:.1f}%)".format(
+            self.requests, self.connections_opened, self.connections_reused,
+            self.reuse_rate * 100)
+
+
+def _counting_pool(pool_cls, stats):
+    # Subclass the urllib3 pool so that every socket its connections open is
+    # recorded, including silent reconnects of dropped keep-alive connections.
+    class CountingConnection(pool_cls.ConnectionCls):
+        def connect(self):
+            super().connect()
+            stats.connection_opened()
+
+    class CountingPool(pool_cls):
+        ConnectionCls = CountingConnection
+
+    return CountingPool
+
+
+class CountingAdapter(HTTPAdapter):
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.stats),
+            "https": _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+
+class ArchiveSession():
+    """
+    A requests.Session with a keep-alive connection pool, shared by all calls
+    to the archive so that consecutive pages reuse the same TCP/TLS connection.
+        pool_connections - number of distinct hosts to keep pools for
+        pool_maxsize - connections kept alive per host; should be at least the
+            number of concurrent requests made to a single host
+        pool_block - if True, pool_maxsize is a hard per-host limit and extra
+            requests wait for a free connection instead of opening a new one
+        timeout - default (connect, read) timeout for every request
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                 timeout=DEFAULT_TIMEOUT):
+        self.stats = ConnectionStats()
+        self.timeout = timeout
+        self.adapter = CountingAdapter(self.stats,
+                                       pool_connections=pool_connections,
+                                       pool_maxsize=pool_maxsize,
+                                       pool_block=pool_block)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        self.stats.request_made()
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def get_session():
+    """Return the shared ArchiveSession, creating it with the default
+    settings if configure_session has not been called."""
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = ArchiveSession()
+        return _default_session
+
+
+def configure_session(**kwargs):
+    """Replace the shared ArchiveSession with one built from the given
+    ArchiveSession keyword arguments."""
+    global _default_session
+    with _default_session_lock:
+        if _default_session is not None:
+            _default_session.close()
+        _default_session = ArchiveSession(**kwargs)
+        return _default_session
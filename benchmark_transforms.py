@@ -0,0 +1,148 @@
+import sys
+import time
+import argparse
+import pandas as pd
+from frame_loader import load_frames
+from frame_transforms import (parse_dates_obs, area_centroids,
+                              reduce_to_best_frames)
+from block_extraction import extract_blocks, block_gaps
+import get_dataframe_lco_default as gdf
+
+DEFAULT_DATASET = "data/ogg_2m0a_2015-04-01_2015-06-01"
+
+
+def time_call(fn, *args, repeats=3):
+    """Best wall time of several calls of fn, and the result of the last."""
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def report(name, old_time, new_time, rows):
+    print("{:<24} {:>9.4f}s {:>9.4f}s {:>7.1f}x  ({} rows)".format(
+        name, old_time, new_time, old_time / max(new_time, 1e-9), rows))
+
+
+### Benchmarks ###
+
+def benchmark_dates(raw):
+    dates = raw['DATE_OBS']
+    old_time, old = time_call(lambda d: d.apply(gdf.str_to_datetime), dates)
+    new_time, new = time_call(lambda d: parse_dates_obs(d, False), dates)
+    assert (pd.to_datetime(old) == new).all(), "DATE_OBS results differ"
+    report("DATE_OBS parsing", old_time, new_time, len(dates))
+
+
+def benchmark_centroids(raw):
+    areas = raw['area']
+    old_time, old = time_call(lambda a: a.apply(gdf.get_centroid), areas)
+    new_time, new = time_call(area_centroids, areas)
+    old = old.astype(float)
+    # Only footprints straddling RA 0/360 (or +-180) should differ
+    differ = (old[0] != new['RA']) & new['RA'].notna()
+    assert (old[1].fillna(0) == new['DEC'].fillna(0)).all(), "Dec differs"
+    report("Footprint centroids", old_time, new_time, len(areas))
+    print(f"  {differ.sum()} footprints corrected for RA wrap-around")
+
+
+def reduce_frames_per_group(df):
+    # The original reduce_frames loop, kept as the reference implementation
+    return pd.concat([
+        obs_frames[obs_frames['RLEVEL'] == obs_frames['RLEVEL'].max()].head(1)
+        for d, obs_frames in df.groupby('datetime')])
+
+
+def benchmark_reduce_frames(raw):
+    df = raw[['DATE_OBS', 'RLEVEL', 'OBSTYPE']].copy()
+    df['datetime'] = parse_dates_obs(df['DATE_OBS'], False)
+    old_time, old = time_call(reduce_frames_per_group, df)
+    new_time, new = time_call(lambda d: reduce_to_best_frames(d, verbose=False),
+                              df)
+    assert old.index.equals(new.index), "Reduced frames differ"
+    report("reduce_frames", old_time, new_time, len(df))
+
+
+def block_frame_table(raw):
+    """The reduced, date-sorted frame table setup() extracts blocks from.
+    Repeated copies of the dataset in raw are spread out into distinct
+    blocks a year apart."""
+    copies = len(raw) // max(raw['id'].nunique(), 1)
+    frames = raw.iloc[:len(raw) // max(copies, 1)].copy()
+    frames['datetime'] = parse_dates_obs(frames['DATE_OBS'], False)
+    frames[['RA', 'DEC']] = area_centroids(frames['area'])
+    frames = reduce_to_best_frames(frames[gdf.desired_columns], verbose=False)
+    frames['PROPID'] = frames['PROPID'].apply(gdf.fill_empty_proposal)
+
+    blkuid_step = frames['BLKUID'].max() + 1
+    shifted = []
+    for i in range(max(copies, 1)):
+        copy = frames.copy()
+        copy['BLKUID'] += i * blkuid_step
+        copy['datetime'] += pd.Timedelta(days=365 * i)
+        shifted.append(copy)
+    return pd.concat(shifted).sort_values('datetime').reset_index(drop=True)
+
+
+def benchmark_blocks(raw):
+    df = block_frame_table(raw)
+    old_time, old = time_call(gdf.extract_science_blocks, df, repeats=1)
+    new_time, new = time_call(extract_blocks, df, repeats=1)
+    pd.testing.assert_frame_equal(old, new, check_dtype=False,
+                                  check_exact=True)
+    report("Science blocks", old_time, new_time, len(df))
+
+
+def largest_gap_per_row(df):
+    # The original get_largest_intrablock_gap loop, kept as the reference
+    sdf = df.sort_values('datetime')
+    largest_gap = 0
+    for i in range(len(sdf)-1):
+        current_ending = sdf.datetime.iloc[i] + pd.Timedelta(
+            seconds=float(sdf.EXPTIME.iloc[i]))
+        gap = (sdf.datetime.iloc[i+1] - current_ending).total_seconds()
+        if gap > largest_gap:
+            largest_gap = gap
+    return largest_gap
+
+
+def benchmark_gaps(raw):
+    df = block_frame_table(raw)
+    df = df[df['BLKUID'].notna()]
+    old_time, old = time_call(
+        lambda d: d.groupby('BLKUID')[['datetime', 'EXPTIME']].apply(
+            largest_gap_per_row), df, repeats=1)
+    new_time, new = time_call(block_gaps, df)
+    assert (old.to_numpy() == new['largest_gap'].to_numpy()).all(), \
+        "Largest gaps differ"
+    report("Intrablock gaps", old_time, new_time, len(df))
+
+
+BENCHMARKS = [benchmark_dates, benchmark_centroids, benchmark_reduce_frames,
+              benchmark_blocks, benchmark_gaps]
+
+################################################################################
+
+def parse_args(cl_args):
+    parser = argparse.ArgumentParser(
+        description="Compare the per-row and vectorised frame transforms.")
+    parser.add_argument("dataset", nargs="?", default=DEFAULT_DATASET,
+                        help="Dataset directory to benchmark on.")
+    parser.add_argument("-x", "--scale", type=int, default=20,
+                        help="""Repeat the dataset's frames this many times to
+                        simulate a larger dataset.""")
+    return parser.parse_args(cl_args)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    raw = load_frames(args.dataset)
+    raw = pd.concat([raw] * args.scale, ignore_index=True)
+
+    print("{:<24} {:>10} {:>10} {:>8}".format("", "per-row", "vectorised",
+                                              "speedup"))
+    for benchmark in BENCHMARKS:
+        benchmark(raw)
@@ -0,0 +1,286 @@
+import datetime as dt
+import numpy as np
+import pandas as pd
+from numpy import finfo
+from patterns import encode_patterns
+
+SCIENCE_PROPID_PATTERN = r'\w+\d{4}\w-\d+'
+SCIENCE_OBSTYPES = ['EXPOSE', 'SPECTRUM']
+MOVING_THRESHOLD = 0.001    # Degrees of RA or Dec, about 4 arcseconds
+GAP_THRESHOLD = 60.         # Seconds idle between frames counted as a gap
+
+BLOCK_COLUMNS = ['blkuid', 'propid', 'start_date', 'duration', 'exposure_sum',
+                 'science_exposure_sum', 'time_efficiency',
+                 'exposure_science_efficiency', 'total_science_efficiency',
+                 'largest_gap', 'target', 'mean_ra', 'mean_dec', 'moving',
+                 'pattern', 'orphan', 'reqnum', 'instrument', 'num_exposures',
+                 'science_exposure_times']
+
+
+### Grouped kernels ###
+# All of these work on a table sorted so that the rows of each block are
+# contiguous, described by the block number of every row.
+
+def block_numbers(blkuids):
+    """Number the blocks of rows sorted by BLKUID from 0. Returns the block
+    number of every row and the number of blocks."""
+    if len(blkuids) == 0:
+        return np.array([], dtype=np.int64), 0
+    block_ids = np.concatenate(
+        [[0], np.cumsum(blkuids[1:] != blkuids[:-1])]).astype(np.int64)
+    return block_ids, int(block_ids[-1]) + 1
+
+
+def block_bounds(block_ids, n_blocks):
+    """Start row and number of rows of each block."""
+    lengths = np.bincount(block_ids, minlength=n_blocks)
+    starts = np.cumsum(lengths) - lengths
+    return starts, lengths
+
+
+def grouped_sum(values, block_ids, n_blocks):
+    """Sum of the values of each block, NaN counting as 0, identical to
+    calling Series.sum() on each block. Blocks of the same length are
+    summed together as the rows of one 2D array, so that numpy adds up each
+    block's values in the same order as it would on its own."""
+    values = np.where(np.isnan(values), 0.0, values)
+    starts, lengths = block_bounds(block_ids, n_blocks)
+    sums = np.zeros(n_blocks)
+    for length in np.unique(lengths[lengths > 0]):
+        blocks = np.flatnonzero(lengths == length)
+        rows = starts[blocks][:, None] + np.arange(length)
+        sums[blocks] = values[rows].sum(axis=1)
+    return sums
+
+
+def grouped_mean(values, block_ids, n_blocks):
+    """Mean of the non-NaN values of each block, as Series.mean()."""
+    counts = np.bincount(block_ids, weights=~np.isnan(values),
+                         minlength=n_blocks)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return grouped_sum(values, block_ids, n_blocks) / counts
+
+
+def grouped_nunique(values, block_ids, n_blocks):
+    """Number of distinct values (NaN included) in each block."""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    pairs = np.unique(block_ids.astype(np.int64) * len(uniques) + codes)
+    return np.bincount(pairs // max(len(uniques), 1), minlength=n_blocks)
+
+
+def exposure_microseconds(exptime):
+    """EXPTIME in whole microseconds, rounded exactly as
+    datetime.timedelta(seconds=...) rounds them."""
+    exptime = np.asarray(exptime, dtype=float)
+    known = ~np.isnan(exptime)
+    # There are only ever a handful of distinct exposure times
+    unique = np.unique(exptime[known])
+    microseconds = np.array([dt.timedelta(seconds=float(e)) //
+                             dt.timedelta(microseconds=1) for e in unique],
+                            dtype=np.int64)
+    result = np.zeros(len(exptime), dtype=np.int64)
+    result[known] = microseconds[np.searchsorted(unique, exptime[known])]
+    return result
+
+
+def total_seconds(nanoseconds):
+    """Timedelta.total_seconds() of int64 nanosecond time differences,
+    computed from their days, seconds and microseconds as pandas does."""
+    microseconds = np.floor_divide(nanoseconds, 1000)
+    days, remainder = np.divmod(microseconds, 86400 * 10**6)
+    seconds, microseconds = np.divmod(remainder, 10**6)
+    return (days * 86400 + seconds).astype(float) + microseconds / 1e6
+
+
+def frame_times(df):
+    """Start times in int64 nanoseconds and EXPTIMEs in whole microseconds
+    of the rows of a frame table."""
+    start_ns = df['datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    return start_ns, exposure_microseconds(df['EXPTIME'].astype(float))
+
+
+def intrablock_gaps(start_ns, exposure_us, block_ids):
+    """The idle time in seconds between the end of each frame and the start
+    of the next frame of the same block, for rows sorted by block and then
+    by start time. The last row of each block has no following gap (NaN)."""
+    gaps = np.full(len(start_ns), np.nan)
+    if len(start_ns) > 1:
+        end_ns = start_ns[:-1] + exposure_us[:-1] * 1000
+        same_block = block_ids[1:] == block_ids[:-1]
+        gaps[:-1] = np.where(same_block, total_seconds(start_ns[1:] - end_ns),
+                             np.nan)
+    return gaps
+
+
+def gap_distribution(gaps, block_ids, n_blocks, threshold=GAP_THRESHOLD):
+    """
+    Summarise the intrablock gaps of each block as a DataFrame of:
+        largest_gap - the longest gap in seconds, 0 if there are none
+        gaps_over_threshold - the number of gaps longer than threshold seconds
+        idle_time - the total of the gaps in seconds
+    Overlapping frames (negative gaps) are not counted as idle time.
+    """
+    positive = gaps > 0
+    largest_gap = np.zeros(n_blocks)
+    np.maximum.at(largest_gap, block_ids[positive], gaps[positive])
+    return pd.DataFrame({
+        'largest_gap': largest_gap,
+        'gaps_over_threshold': np.bincount(block_ids[gaps > threshold],
+                                           minlength=n_blocks),
+        'idle_time': np.bincount(block_ids[positive], weights=gaps[positive],
+                                 minlength=n_blocks)
+    })
+
+
+def block_gaps(frames, threshold=GAP_THRESHOLD):
+    """The gap distribution (see gap_distribution) of every block in a
+    frame table, indexed by BLKUID. Frames need not be sorted, and those
+    without a BLKUID are ignored."""
+    frames = frames[frames['BLKUID'].notna()]
+    frames = frames.sort_values(['BLKUID', 'datetime'], kind='stable')
+    blkuids = frames['BLKUID'].to_numpy()
+    block_ids, n_blocks = block_numbers(blkuids)
+    starts, lengths = block_bounds(block_ids, n_blocks)
+
+    gaps = intrablock_gaps(*frame_times(frames), block_ids)
+    distribution = gap_distribution(gaps, block_ids, n_blocks, threshold)
+    distribution.index = pd.Index(blkuids[starts], name='BLKUID')
+    return distribution
+
+
+def mixed_target(objects, obstypes):
+    """The target of a block observing several OBJECTs, by the same rules as
+    extract_target but without printing the block: spectroscopic blocks
+    whose first two calibration frames were taken before the telescope moved
+    take the final OBJECT, and any other block a sorted tuple of all of them.
+    Returns (target, resolved) where resolved is False for the tuples."""
+    if all(x in ('SPECTRUM', 'ARC', 'LAMPFLAT') for x in obstypes) and \
+            len(pd.unique(objects[2:])) == 1:
+        return objects[-1], True
+    return tuple(sorted(pd.unique(objects))), False
+
+
+################################################################################
+
+def extract_blocks(all_df, verbose=True):
+    """
+    Summarise the science blocks (frames sharing a BLKUID under a science
+    proposal) of a reduced, date-sorted frame table, giving the same block
+    DataFrame as extract_science_blocks. Every column is computed with
+    grouped operations over the frame table sorted by block; only the
+    targets of the rare blocks observing several objects are found per
+    block in Python.
+
+    As with extract_science_blocks, None is returned if a block is found
+    with more than one proposal. Blocks whose target could not be resolved
+    are counted rather than printed, and the count is printed if verbose.
+    """
+    science = all_df['PROPID'].astype(str).str.match(SCIENCE_PROPID_PATTERN)
+    df = all_df[science.to_numpy(dtype=bool) & all_df['BLKUID'].notna()]
+    if len(df) == 0:
+        return pd.DataFrame([])
+
+    # Blocks in BLKUID order, with their frames kept in date order
+    df = df.sort_values('BLKUID', kind='stable').reset_index(drop=True)
+    blkuids = df['BLKUID'].to_numpy()
+    block_ids, n_blocks = block_numbers(blkuids)
+    starts, lengths = block_bounds(block_ids, n_blocks)
+    lasts = starts + lengths - 1
+
+    propid_counts = grouped_nunique(df['PROPID'].to_numpy(), block_ids,
+                                    n_blocks)
+    if (propid_counts > 1).any():
+        block = np.flatnonzero(propid_counts > 1)[0]
+        print("ERROR: Block with multiple science propids")
+        print(list(df['PROPID'].iloc[starts[block]:lasts[block] + 1].unique()))
+        return None
+
+    # Times and exposures
+    exptime = df['EXPTIME'].astype(float).to_numpy()
+    start_ns, exposure_us = frame_times(df)
+    start_date = df['datetime'].iloc[starts].reset_index(drop=True)
+    end_ns = start_ns[lasts] + exposure_us[lasts] * 1000
+    duration = total_seconds(end_ns - start_ns[starts])
+
+    is_science = df['OBSTYPE'].isin(SCIENCE_OBSTYPES).to_numpy()
+    science_ids = block_ids[is_science]
+    science_counts = np.bincount(science_ids, minlength=n_blocks)
+    exposure_sum = grouped_sum(exptime, block_ids, n_blocks) + finfo(float).eps
+    science_exposure_sum = grouped_sum(exptime[is_science], science_ids,
+                                       n_blocks)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        time_efficiency = np.round(exposure_sum / duration, 5)
+        exposure_science_efficiency = np.round(
+            science_exposure_sum / exposure_sum, 5)
+        total_science_efficiency = np.round(science_exposure_sum / duration, 5)
+
+    gaps = intrablock_gaps(start_ns, exposure_us, block_ids)
+    largest_gap = gap_distribution(gaps, block_ids, n_blocks)['largest_gap']
+
+    # Position
+    ra = df['RA'].to_numpy(dtype=float)
+    dec = df['DEC'].to_numpy(dtype=float)
+    mean_ra = grouped_mean(ra, block_ids, n_blocks) / 15.  # In Hours
+    mean_dec = grouped_mean(dec, block_ids, n_blocks)
+    moving = (np.abs(ra[starts] - ra[lasts]) > MOVING_THRESHOLD) | \
+        (np.abs(dec[starts] - dec[lasts]) > MOVING_THRESHOLD)
+
+    # Single valued block properties, with per-block fallbacks for the
+    # blocks holding several values
+    def first_or_tuples(column):
+        values = df[column].to_numpy()
+        result = values[starts].astype(object)
+        for block in np.flatnonzero(grouped_nunique(values, block_ids,
+                                                    n_blocks) > 1):
+            result[block] = tuple(sorted(pd.unique(
+                values[starts[block]:lasts[block] + 1])))
+        return result
+
+    objects = df['OBJECT'].to_numpy()
+    obstypes = df['OBSTYPE'].to_numpy()
+    target = objects[starts].astype(object)
+    unresolved = 0
+    for block in np.flatnonzero(grouped_nunique(objects, block_ids,
+                                                n_blocks) > 1):
+        rows = slice(starts[block], lasts[block] + 1)
+        target[block], resolved = mixed_target(objects[rows], obstypes[rows])
+        unresolved += not resolved
+    if verbose and unresolved > 0:
+        print(f"{unresolved} blocks observed several targets")
+
+    # Patterns and exposure time lists
+    pattern_ids, lookup = encode_patterns(df, block_ids, n_blocks)
+    pattern = np.empty(len(lookup), dtype=object)
+    pattern[:] = lookup
+    science_exptimes = df['EXPTIME'][is_science].tolist()
+    science_starts = np.cumsum(science_counts) - science_counts
+    science_exposure_times = [tuple(science_exptimes[s:s + n])
+                              for s, n in zip(science_starts, science_counts)]
+
+    blocks = pd.DataFrame({
+        'blkuid': blkuids[starts],
+        'propid': df['PROPID'].to_numpy()[starts],
+        'start_date': start_date,
+        'duration': duration,
+        'exposure_sum': exposure_sum,
+        'science_exposure_sum': science_exposure_sum,
+        'time_efficiency': time_efficiency,
+        'exposure_science_efficiency': exposure_science_efficiency,
+        'total_science_efficiency': total_science_efficiency,
+        'largest_gap': largest_gap.to_numpy(),
+        'target': target,
+        'mean_ra': mean_ra,
+        'mean_dec': mean_dec,
+        'moving': moving,
+        'pattern': pattern[pattern_ids],
+        'orphan': science_counts == 0,
+        'reqnum': first_or_tuples('REQNUM'),
+        'instrument': first_or_tuples('INSTRUME'),
+        'num_exposures': lengths,
+        'science_exposure_times': science_exposure_times
+    }, columns=BLOCK_COLUMNS)
+
+    # NOTE: Exclude blocks of Zero duration
+    blocks = blocks[blocks['exposure_sum'] != 0.0].reset_index(drop=True)
+    return blocks.infer_objects()
@@ -0,0 +1,123 @@
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import urllib.parse
+from os.path import join as pathjoin
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import archive_session
+import download_datasets_lco as lco
+from frame_store import datafile_list
+
+# A local stand-in for the archive's frames endpoint, used to check that
+# downloads reuse their kept-alive connections:
+#     python check_archive_session.py [--frames N] [--concurrency C]
+
+DEFAULT_FRAMES = 1300
+DEFAULT_CONCURRENCY = 4
+RESPONSE_DELAY = 0.02   # Seconds per page, so that concurrent requests overlap
+PARAMS = {"SITEID": "tst", "TELID": "0m0a", "start": "2020-01-01 00:00",
+          "end": "2020-02-01 00:00"}
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """Serves pages of 'frames' synthetic frames with the archive's count,
+    next and results fields, keeping connections alive between requests."""
+    protocol_version = "HTTP/1.1"
+    frames = DEFAULT_FRAMES
+
+    def do_GET(self):
+        time.sleep(RESPONSE_DELAY)
+        query = urllib.parse.urlparse(self.path).query
+        params = dict(urllib.parse.parse_qsl(query))
+        limit = int(params.get("limit", lco.REQUEST_ENTRY_LIMIT))
+        offset = int(params.get("offset", 0))
+
+        next_url = None
+        if offset + limit < self.frames:
+            next_params = dict(params, offset=offset + limit)
+            next_url = "http://{}:{}/frames/?{}".format(
+                *self.server.server_address,
+                urllib.parse.urlencode(next_params))
+        body = json.dumps({
+            "count": self.frames,
+            "next": next_url,
+            "results": [{"id": i, "DATE_OBS": "2020-01-01T00:00:00.000Z"}
+                        for i in range(offset, min(offset + limit,
+                                                   self.frames))]
+        }).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(frames):
+    handler = type("Handler", (ArchiveHandler,), {"frames": frames})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check_download(server, concurrency, frames):
+    """Download the stand-in dataset through a fresh shared session, check
+    every frame arrived and return the session's connection stats."""
+    session = archive_session.configure_session(
+        pool_maxsize=max(archive_session.DEFAULT_POOL_MAXSIZE, concurrency))
+    with tempfile.TemporaryDirectory() as dir_path:
+        lco.download_data(dict(PARAMS), concurrency=concurrency,
+                          dir_path=dir_path)
+        downloaded = 0
+        for filename in datafile_list(dir_path):
+            with open(pathjoin(dir_path, filename), "r") as f:
+                downloaded += len(json.load(f))
+    assert downloaded == frames, \
+        f"{downloaded} of {frames} frames downloaded"
+    return session.stats
+
+
+def check_reuse(frames=DEFAULT_FRAMES, concurrency=DEFAULT_CONCURRENCY):
+    server = start_server(frames)
+    url_base = lco.URL_BASE
+    lco.URL_BASE = "http://{}:{}/frames/?".format(*server.server_address)
+    try:
+        # A serial download only ever needs its first connection
+        stats = check_download(server, 1, frames)
+        print(f"Serial: {stats.summary()}")
+        assert stats.connections_opened == 1, stats.summary()
+        assert stats.reuse_rate == (stats.requests - 1) / stats.requests
+
+        # Concurrent pages need at most one connection per worker
+        stats = check_download(server, concurrency, frames)
+        print(f"Concurrency {concurrency}: {stats.summary()}")
+        assert stats.connections_opened <= concurrency, stats.summary()
+        assert stats.reuse_rate >= 1 - concurrency / stats.requests
+    finally:
+        lco.URL_BASE = url_base
+        server.shutdown()
+        server.server_close()
+    print("Connection reuse checks passed")
+
+################################################################################
+
+def parse_args(cl_args):
+    parser = argparse.ArgumentParser(
+        description="Check archive connection reuse against a local server.")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES,
+                        help="Number of frames the stand-in archive holds.")
+    parser.add_argument("--concurrency", type=int,
+                        default=DEFAULT_CONCURRENCY,
+                        help="Page requests in flight in the concurrent check.")
+    return parser.parse_args(cl_args)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    check_reuse(args.frames, args.concurrency)
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import tempfile
+import warnings
+import pandas as pd
+from os.path import join as pathjoin
+from frame_loader import load_frames
+from frame_store import datafile_list
+from get_dataframe_lco_default import setup, source_columns, desired_columns
+
+# Checks that datasets holding empty datafile chunks (as the archive gives for
+# telescope-months without frames) load and set up cleanly:
+#     python check_frame_loader.py [dataset directory with frames]
+
+DEFAULT_DATASET = "data/ogg_2m0a_2015-04-01_2015-06-01"
+
+
+def write_chunks(dir_path, chunks):
+    os.makedirs(dir_path)
+    for index, frames in enumerate(chunks):
+        with open(pathjoin(dir_path, f"datafile_{index}.json"), "w") as f:
+            json.dump(frames, f)
+
+
+def check_empty_chunks(dataset=DEFAULT_DATASET):
+    frames = []
+    for filename in datafile_list(dataset):
+        with open(pathjoin(dataset, filename), "r") as f:
+            frames += json.load(f)
+    half = len(frames) // 2
+
+    with tempfile.TemporaryDirectory() as root, warnings.catch_warnings():
+        # Concatenating empty chunks must not rely on deprecated behaviour
+        warnings.simplefilter("error", FutureWarning)
+
+        empty = pathjoin(root, "empty")
+        write_chunks(empty, [[], []])
+        df = load_frames(empty, source_columns, verbose=False)
+        assert len(df) == 0 and list(df.columns) == source_columns, \
+            list(df.columns)
+        for kwargs in [{}, {"return_raw": True}]:
+            df, blocks, raw = setup(empty, use_cache=False, **kwargs)
+            assert len(df) == 0 and list(df.columns) == desired_columns, \
+                list(df.columns)
+            assert len(blocks) == 0
+
+        mixed = pathjoin(root, "mixed")
+        write_chunks(mixed, [frames[:half], [], frames[half:]])
+        df = load_frames(mixed, source_columns, verbose=False)
+        expected = load_frames(dataset, source_columns, verbose=False)
+        assert df.equals(expected), "frames differ with an empty chunk"
+        filtered = load_frames(mixed, source_columns, verbose=False,
+                               obstypes=['EXPOSE'])
+        assert len(filtered) == (expected['OBSTYPE'] == 'EXPOSE').sum()
+        df = setup(mixed, use_cache=False)[0]
+        assert len(df) > 0
+        # Grouping set up frames only gives the values present
+        assert not any(isinstance(t, pd.CategoricalDtype) for t in df.dtypes)
+        assert len(df.groupby('OBSTYPE')) == df['OBSTYPE'].nunique()
+    print("Empty chunk checks passed")
+
+################################################################################
+
+if __name__ == '__main__':
+    check_empty_chunks(*sys.argv[1:2])
@@ -4,118 +4,196 @@
 
 from get_dataframe_lco import *
 
-def check_reqnums(df):
+# Frame fields the checks read
+CHECK_COLUMNS = ['id','DATE_OBS','REQNUM','PROPID','OBJECT','INSTRUME',
+    'EXPTIME','FILTER','OBSTYPE','RLEVEL']
+
+### Validation engine ###
+# Each check groups the frames on a key and counts the distinct values of
+# some columns in every group with one grouped nunique, rather than calling
+# unique() on each group in turn. Violations are reported as a DataFrame
+# with one row per group and column holding several values:
+#     check, key, column, num_values, values, num_frames
+# and at most max_examples violating groups of each check and column are
+# kept as examples.
+
+MAX_EXAMPLES = 5
+REPORT_COLUMNS = ['check', 'key', 'column', 'num_values', 'values',
+                  'num_frames']
+
+
+def group_keys(groups):
+    """The key of each group of a grouped aggregation as a list, giving
+    tuples for groups on several columns as groupby does."""
+    return groups.index.tolist()
+
+
+def concat_reports(frames, columns=(), **kwargs):
+    """Concatenate report (or example) frames, leaving out empty ones, or
+    give an empty frame with columns if none have any rows."""
+    frames = [f for f in frames if len(f) > 0]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=list(columns))
+    return pd.concat(frames, **kwargs)
+
+
+def find_violations(df, check, keys, columns, max_examples=MAX_EXAMPLES):
+    """
+    Find the groups of frames sharing keys (frames with a missing key are
+    skipped, as by groupby) that hold more than one distinct value (NaN
+    counting as a value) of any of columns. Returns the report of violations
+    and a DataFrame of the frames of up to max_examples violating groups
+    per column, with the check and column they are examples of.
+    """
+    grouped = df.groupby(keys, sort=True, observed=True)
+    counts = grouped[columns].nunique(dropna=False)
+    sizes = grouped.size()
+
+    reports = []
+    examples = []
+    for column in columns:
+        violating = counts.index[(counts[column] > 1).to_numpy()]
+        if len(violating) == 0:
+            continue
+        # Distinct values are only found for the violating groups
+        in_violation = df.set_index(keys).index.isin(violating)
+        subset = df[in_violation]
+        values = subset.groupby(keys, sort=True, observed=True)[column] \
+            .unique()
+        reports.append(pd.DataFrame({
+            'check': check,
+            'key': group_keys(values),
+            'column': column,
+            'num_values': counts.loc[values.index, column].to_numpy(),
+            'values': [tuple(v) for v in values],
+            'num_frames': sizes.loc[values.index].to_numpy()
+        }))
+
+        example_keys = violating[:max_examples]
+        example = subset[subset.set_index(keys).index.isin(example_keys)]
+        examples.append(example.assign(check=check, column=column))
+
+    report = concat_reports(reports, REPORT_COLUMNS, ignore_index=True)
+    examples = concat_reports(examples)
+    return report, examples
+
+
+def check_reqnums(df, max_examples=MAX_EXAMPLES):
     # Check that no simultaneous requests have different REQNUMs
     print("Checking if all simultaneous frames belong to same request...")
-    date_grouper = group_generator(df, 'DATE_OBS')
-    triggered = False
-    trig_cases = []
-    while True:
-        try:
-            val, group = next(date_grouper)
-            if len(group) > 1:
-                if len(group['REQNUM'].unique()) > 1:
-                    triggered = True
-                    trig_cases.append( [val, list(group['REQNUM'].unique())] )
-        except StopIteration:
-            break
-    if triggered:
+    report, examples = find_violations(df, 'reqnums', 'DATE_OBS', ['REQNUM'],
+                                       max_examples)
+    if len(report) > 0:
         print("WARNING: Some frames at identical times have different REQNUMs")
-        for case in trig_cases:
-            print(case)
+        for case in report[['key', 'values']].head(max_examples).values:
+            print([case[0], list(case[1])])
+        if len(report) > max_examples:
+            print("... and {} more".format(len(report) - max_examples))
     else:
         print("Success: All simultaneous frames are of the same Requests")
+    return report, examples
+
 
-def check_request_homogeneity(df):
+def check_request_homogeneity(df, max_examples=MAX_EXAMPLES):
     # Check that all frames in each request are from the same proposal?
     print("Checking homogeneity within requests...")
     params_to_check = ['PROPID','OBJECT','INSTRUME'] # area?
-
-    req_grouper = group_generator(df,'REQNUM')
-    trigger_cases = {}
-    multiple_target_type_set = set()
-    while True:
-        try:
-            val, group = next(req_grouper)
-            if len(group) > 1:
-                for param in params_to_check:
-                    if len(group[param].unique()) > 1:
-                        print(group[param].unique())
-
-                        print(group['OBSTYPE'].unique())
-                        type_uniques = group['OBSTYPE'].unique()
-                        sorted_uniques = sorted(list(type_uniques))
-                        tuple_uniques = tuple(sorted_uniques)
-                        multiple_target_type_set.add(tuple_uniques)
-
-                        try:
-                            trigger_cases[param] += 1
-                        except:
-                            trigger_cases[param] = 1
-        except StopIteration:
-            break
+    report, examples = find_violations(df, 'request_homogeneity', 'REQNUM',
+                                       params_to_check, max_examples)
 
     for param in params_to_check:
-        if param in trigger_cases:
-            print("Multiple unexpected values for {}".format(param))
+        cases = report[report['column'] == param]
+        if len(cases) > 0:
+            print("Multiple unexpected values for {} in {} requests".format(
+                param, len(cases)))
+            for values in cases['values'].head(max_examples):
+                print(list(values))
         else:
             print("Parameter '{}' is homogeneous across requests".format(param))
 
-    print(multiple_target_type_set)
+    # The combinations of frame types in the requests with several values
+    inhomogeneous = df[df['REQNUM'].isin(report['key'])]
+    type_sets = inhomogeneous.groupby('REQNUM', observed=True)['OBSTYPE'] \
+        .unique()
+    print(set(tuple(sorted(types)) for types in type_sets))
+    return report, examples
+
 
 def check_request_areas(df):
     # This one has to be done separately because the contained dicts are not
     # hashable.
     pass
 
-def check_exposure_homogeneity(df):
-    # Check that all rfames within an exposure have the same EXPTIME, OBJECT,
+
+def check_exposure_homogeneity(df, max_examples=MAX_EXAMPLES):
+    # Check that all frames within an exposure have the same EXPTIME, OBJECT,
     #   INSTRUME and FILTER
     print("Checking homogeneity of frames in the same exposure...")
     params_to_check = ['EXPTIME','OBJECT','INSTRUME','FILTER']
-    exp_grouper = group_generator(df,['REQNUM','DATE_OBS'])
-    show_columns = ['id','EXPTIME','OBSTYPE','OBJECT','INSTRUME','FILTER','RLEVEL']
-
-    trig_cases = {}
-    frame_nums = {}
-    frame_num_examples = {}
-    while True:
-        try:
-            val, group = next(exp_grouper)
-            n = len(group)
-            try:
-                frame_nums[n] += 1
-                frame_num_examples[n].append(group)
-            except:
-                frame_nums[n] = 1
-                frame_num_examples[n] = [group]
-
-            if len(group) > 1:
-                for param in params_to_check:
-                    if len(group[param].unique()) > 1:
-                        try:
-                            trig_cases[param] += 1
-                        except:
-                            trig_cases[param] = 1
-        except StopIteration:
-            break
-
-    if len(trig_cases) > 0:
+    keys = ['REQNUM','DATE_OBS']
+    report, examples = find_violations(df, 'exposure_homogeneity', keys,
+                                       params_to_check, max_examples)
+
+    if len(report) > 0:
         print("WARNING: Expected parameters are not homogeneous across exposure frames:")
         print("Cases of differences:")
-        for key in trig_cases:
-            print("{}: {}".format(key,trig_cases[key]))
+        for key, count in report['column'].value_counts(sort=False).items():
+            print("{}: {}".format(key,count))
     else:
         print("Success: exposure frames are indeed homogeneous")
 
-    for num in sorted(frame_nums.keys()):
-        print("Exposures with {} frame(s): {}".format(num,frame_nums[num]))
+    # Number of exposures of each size, and the frame types found in them
+    frames = df.dropna(subset=keys)
+    grouped = frames.groupby(keys, observed=True)
+    exposure_counts = grouped.size().value_counts()
+    for num in sorted(exposure_counts.index):
+        print("Exposures with {} frame(s): {}".format(num,
+            exposure_counts[num]))
+    sizes = grouped['OBSTYPE'].transform('size').to_numpy()
+    for num, types in frames.groupby(sizes)['OBSTYPE'].unique().items():
+        print("{}: {}".format(num,set(types)))
+    return report, examples
+
+
+def validate_frames(df, max_examples=MAX_EXAMPLES):
+    """Run every check on a frame table, returning the combined report and
+    examples."""
+    results = [check(df, max_examples) for check in
+               [check_reqnums, check_request_homogeneity,
+                check_exposure_homogeneity]]
+    report = concat_reports([r for r, e in results], REPORT_COLUMNS,
+                            ignore_index=True)
+    examples = concat_reports([e for r, e in results])
+    return report, examples
+
+
+def validate_tree(root_path='data', max_examples=MAX_EXAMPLES):
+    """
+    Run every check on each complete dataset under root_path, returning one
+    report of the violations in all of them (with a 'dataset' column) and
+    their examples.
+    """
+    reports = []
+    examples = []
+    for root, dirs, files in os.walk(root_path):
+        dirs.sort()
+        if "_complete" not in files:
+            continue
+        print("\n### {} ###".format(root))
+        df = load_frames(root, CHECK_COLUMNS)
+        if len(df) == 0 or not set(CHECK_COLUMNS).issubset(df.columns):
+            print("No frames to check")
+            continue
+        report, example = validate_frames(df, max_examples)
+        reports.append(report.assign(dataset=root))
+        examples.append(example.assign(dataset=root))
 
-    for num in frame_num_examples:
-        types = set()
-        for g in frame_num_examples[num]:
-            types.update(set(g['OBSTYPE'].unique()))
-        print("{}: {}".format(num,types))
+    report = concat_reports(reports, REPORT_COLUMNS + ['dataset'],
+                            ignore_index=True)
+    examples = concat_reports(examples, ignore_index=True)
+    print("\n{} violations in {} datasets".format(len(report),
+        report['dataset'].nunique()))
+    return report, examples
 
 # def check_arc_lampflat_previous_exposure(df):
 #     # For spectrum exposures preceeded by a lampflat and arc, sometimes the
@@ -181,8 +259,7 @@ def reduce_frames(df):
 ################################################################################
 
 if __name__ == '__main__':
-    df = merge_datasets('data/lco_data/coj_2m0a_2016-02-01_2016-08-01')
-    check_reqnums(df)
-    check_request_homogeneity(df)
-    # check_exposure_homogeneity(df)
+    # Check every dataset under the given directory (data/ by default)
+    report, examples = validate_tree(sys.argv[1] if len(sys.argv) > 1
+                                     else 'data')
     # check_arc_lampflat_previous_exposure(df)
@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+from os.path import join as pathjoin
+
+PART_PREFIX = "_partial_"
+
+
+class ChunkWriter():
+    """
+    Streams pages of frames into a sequence of JSON array chunk files
+    (file_base.format(index)) of up to entry_limit frames each, so that no more
+    than the current page is ever held in memory.
+
+    Each chunk is written to '_partial_<name>' and only renamed to its final
+    name once it is complete and fsynced, so a finished chunk file is always a
+    valid JSON array and an interrupted chunk is never picked up as a datafile
+    by the loaders or the resume logic.
+
+    To resume an interrupted chunk, pass the byte position and frame count
+    at the end of its last intact page as resume_position and resume_count;
+    anything written after that position is truncated.
+    """
+
+    def __init__(self, dir_path, file_base, entry_limit, file_index=0,
+                 resume_position=None, resume_count=0):
+        self.dir_path = dir_path
+        self.file_base = file_base
+        self.entry_limit = entry_limit
+        self.file_index = file_index
+        self.chunk_count = 0        # Frames written to the current chunk
+        self.position = 0           # Bytes written to the current chunk
+        self.total_count = 0        # Frames written by this writer
+        self.bytes_written = 0      # Bytes written by this writer
+        self._file = None
+        if resume_position is None:
+            self._open_chunk()
+        else:
+            self._reopen_chunk(resume_position, resume_count)
+
+    def _chunk_path(self, file_index, partial=False):
+        filename = self.file_base.format(file_index)
+        if partial:
+            filename = PART_PREFIX + filename
+        return pathjoin(self.dir_path, filename)
+
+    def _write(self, text):
+        # Frames are serialised with ensure_ascii, so characters are bytes
+        self._file.write(text)
+        self.position += len(text)
+        self.bytes_written += len(text)
+
+    def _open_chunk(self):
+        self._file = open(self._chunk_path(self.file_index, True), "w")
+        self.chunk_count = 0
+        self.position = 0
+        self._write("[")
+
+    def _reopen_chunk(self, position, count):
+        self._file = open(self._chunk_path(self.file_index, True), "r+")
+        self._file.truncate(position)
+        self._file.seek(position)
+        self.chunk_count = count
+        self.position = position
+
+    def _finish_chunk(self):
+        self._write("]")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self._chunk_path(self.file_index, True),
+                   self._chunk_path(self.file_index))
+
+    def write_page(self, frames):
+        """Append a page of frames to the current chunk, first rolling over
+        to a new chunk if the current one is full. Pages are never split
+        across chunks.
+
+        Returns a record of where the page was written: the chunk filename
+        and index, the start and length in bytes of its serialised frames,
+        the number of frames and the sha256 of those bytes."""
+        if self.chunk_count >= self.entry_limit:
+            self._finish_chunk()
+            self.file_index += 1
+            self._open_chunk()
+
+        start = self.position
+        page_hash = hashlib.sha256()
+        for frame in frames:
+            text = json.dumps(frame)
+            if self.chunk_count > 0:
+                text = ", " + text
+            self._write(text)
+            page_hash.update(text.encode())
+            self.chunk_count += 1
+            self.total_count += 1
+        self._file.flush()
+
+        return {
+            "file": self.file_base.format(self.file_index),
+            "index": self.file_index,
+            "start": start,
+            "bytes": self.position - start,
+            "count": len(frames),
+            "sha256": page_hash.hexdigest()
+        }
+
+    def close(self):
+        """Finish the current chunk, even if it is empty."""
+        if self._file is not None:
+            self._finish_chunk()
+
+    def abort(self):
+        """Stop writing, leaving the current chunk as an unfinished partial
+        file for a resumed download to carry on from."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+from os.path import join as pathjoin
+from chunk_writer import PART_PREFIX
+
+MANIFEST_NAME = "_manifest.jsonl"
+
+
+class DatasetManifest():
+    """
+    An append-only record of every page of frames written into a dataset
+    directory. Each line of '_manifest.jsonl' is either a page record:
+        {"offset", "count", "file", "index", "start", "bytes", "sha256"}
+    giving the archive offset of the page, the number of frames in it, the
+    chunk file (and its index) holding it and the byte span of its serialised
+    frames within that file, a {"total_count"} record of the dataset size
+    reported by the archive, or a {"fields"} record of the field projection
+    the frames were written with (None for every field).
+
+    Appending one line per page keeps recording cheap, and a line cut short
+    by an interrupted run is simply ignored when the manifest is loaded.
+    """
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.path = pathjoin(dir_path, MANIFEST_NAME)
+        self.pages = {}
+        self.total_count = None
+        self.fields = None
+
+    @classmethod
+    def load(cls, dir_path):
+        manifest = cls(dir_path)
+        if not os.path.isfile(manifest.path):
+            return manifest
+
+        with open(manifest.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    continue
+                if "offset" in record:
+                    manifest.pages[record["offset"]] = record
+                elif "total_count" in record:
+                    manifest.total_count = record["total_count"]
+                elif "fields" in record:
+                    manifest.fields = record["fields"]
+        return manifest
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def _append(self, record):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def record_total_count(self, total_count):
+        if total_count != self.total_count:
+            self.total_count = total_count
+            self._append({"total_count": total_count})
+
+    def record_fields(self, fields):
+        if fields != self.fields:
+            self.fields = fields
+            self._append({"fields": fields})
+
+    def record_page(self, offset, page_record):
+        record = dict(page_record, offset=offset)
+        self.pages[offset] = record
+        self._append(record)
+
+    def discard_pages(self, offsets):
+        """Forget the given pages, rewriting the manifest without them."""
+        for offset in offsets:
+            self.pages.pop(offset, None)
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            if self.total_count is not None:
+                f.write(json.dumps({"total_count": self.total_count}) + "\n")
+            if self.fields is not None:
+                f.write(json.dumps({"fields": self.fields}) + "\n")
+            for offset in sorted(self.pages):
+                f.write(json.dumps(self.pages[offset]) + "\n")
+        os.replace(temp_path, self.path)
+
+    def frame_count(self):
+        return sum(page["count"] for page in self.pages.values())
+
+    def first_offset(self):
+        # Downloads started before manifests existed begin recording part way
+        # through; the frames before the first page are in older chunk files.
+        if len(self.pages) == 0:
+            return 0
+        return min(self.pages)
+
+    def next_offset(self):
+        """The offset following the unbroken run of recorded pages, i.e. the
+        number of frames downloaded so far."""
+        offset = self.first_offset()
+        while offset in self.pages and self.pages[offset]["count"] > 0:
+            offset += self.pages[offset]["count"]
+        return offset
+
+    def pending_offsets(self, start, total_count, page_size):
+        """Page offsets from start to total_count not already recorded."""
+        return [o for o in range(start, total_count, page_size)
+                if o not in self.pages]
+
+    def last_page(self):
+        """The record of the final page in the unbroken run of recorded
+        pages, or None if no pages have been recorded."""
+        offset = self.first_offset()
+        last = None
+        while offset in self.pages and self.pages[offset]["count"] > 0:
+            last = self.pages[offset]
+            offset += last["count"]
+        return last
+
+    def chunk_path(self, filename):
+        """Path of a chunk file, falling back to its unfinished partial file
+        if the chunk has not been completed yet."""
+        final_path = pathjoin(self.dir_path, filename)
+        if os.path.isfile(final_path):
+            return final_path
+        return pathjoin(self.dir_path, PART_PREFIX + filename)
+
+    def verify(self):
+        """Re-read every recorded page from disk and compare its checksum.
+        Returns the sorted offsets of missing or corrupted pages."""
+        bad_offsets = []
+        pages_by_file = {}
+        for offset, page in self.pages.items():
+            pages_by_file.setdefault(page["file"], []).append(page)
+
+        for filename, pages in pages_by_file.items():
+            filepath = self.chunk_path(filename)
+            if not os.path.isfile(filepath):
+                bad_offsets += [page["offset"] for page in pages]
+                continue
+
+            with open(filepath, "rb") as f:
+                for page in sorted(pages, key=lambda p: p["start"]):
+                    f.seek(page["start"])
+                    data = f.read(page["bytes"])
+                    if hashlib.sha256(data).hexdigest() != page["sha256"]:
+                        bad_offsets.append(page["offset"])
+
+        return sorted(bad_offsets)
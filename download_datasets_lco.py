@@ -1,4 +1,3 @@
-import requests
 import sys
 import json
 import os
@@ -7,7 +6,21 @@ import zipfile
 import urllib
 import shutil
 import argparse
+import itertools
+import threading
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from os.path import join as pathjoin
+from requests.exceptions import RequestException
+import archive_session
+from retry_policy import (RetryPolicy, RetryStats, TokenBucket, CircuitBreaker,
+                          CircuitOpenError)
+from chunk_writer import ChunkWriter, PART_PREFIX
+from dataset_manifest import DatasetManifest
+from download_progress import DownloadProgress, ProgressDisplay
+from frame_projection import (FIELD_PRESETS, parse_fields, project_page,
+                              frame_bytes, format_bytes, project_datasets)
 
 DATA_DIR = "data"
 OLD_DATA_DIR = "old_data"
@@ -16,6 +29,20 @@ URL_BASE = "https://archive-api.lco.global/frames/?"
 FILE_ENTRY_LIMIT = 5000
 REQUEST_ENTRY_LIMIT = 100
 FILE_BASE = "datafile_{}.json"
+PARAM_DATE_FORMAT = "%Y-%m-%d %H:%M"
+SHARD_DIR = "shards"
+SHARD_SIZES = ("day", "week", "month")
+SHARD_PARALLEL = 4      # Shards downloaded at once if --parallel isn't given
+MAX_REQUEST_RATE = 10   # Requests per second, shared by all downloads, once
+                        # the archive has throttled them
+
+# Shared by every archive request so that concurrent downloads are throttled
+# and backed off together. Requests are not limited until the archive pushes
+# back (429/503 or Retry-After).
+RETRY_POLICY = RetryPolicy(max_attempts=8,
+                           rate_limiter=TokenBucket(MAX_REQUEST_RATE,
+                                                    unlimited=True),
+                           breaker=CircuitBreaker())
 
 
 def zip_old_data(clear=False):
@@ -81,10 +108,15 @@ def dataset_status(paramsets):
             if os.path.isfile(pathjoin(DATA_DIR, data_name, "_complete")):
                 status = "Complete"
             else:
-                file_count = len([f for f in \
-                                  os.listdir(pathjoin(DATA_DIR, data_name)) \
-                                  if f.startswith("datafile")])
-                entry_count = file_count * FILE_ENTRY_LIMIT
+                manifest = DatasetManifest.load(pathjoin(DATA_DIR, data_name))
+                if manifest.exists():
+                    entry_count = manifest.next_offset()
+                else:
+                    # Estimate from the number of finished chunk files
+                    file_count = len([f for f in \
+                                      os.listdir(pathjoin(DATA_DIR, data_name)) \
+                                      if f.startswith("datafile")])
+                    entry_count = file_count * FILE_ENTRY_LIMIT
                 complete_percent = round(entry_count / total_count * 100)
                 status = f"Incomplete ({complete_percent}%)"
         else:
@@ -101,14 +133,26 @@ def list_param_files():
             print(f)
 
 
-def request_from_param_dict(param_dict):
+def archive_get(url, stats=None, log=print):
+    """GET a URL from the archive through the shared session and retry
+    policy. Returns the response, or None if the request ultimately failed,
+    in which case the reason is passed to log."""
+    try:
+        r = RETRY_POLICY.call(archive_session.get_session().get, url,
+                              stats=stats)
+    except (RequestException, CircuitOpenError) as e:
+        log(f"Request failed: {e}\n")
+        return None
+    if r.status_code != 200:
+        log(f"Request failed: {r.status_code}\nReason:\n{r.reason}\n")
+        return None
+    return r
+
+
+def request_from_param_dict(param_dict, stats=None, log=print):
     encoded_params = urllib.parse.urlencode(param_dict)
     url = URL_BASE + encoded_params
-    r = requests.get(url=url)
-    if r.status_code != 200:
-        print(f"Request failed: {r.status_code}\nReason:\n{r.reason}\n")
-    else:
-        return r
+    return archive_get(url, stats, log)
 
 
 def ask_permissions(param_dict_list):
@@ -144,79 +188,404 @@ def ask_permissions(param_dict_list):
     return selected_param_dicts
 
 
-def determine_start_index(data_name):
+def determine_start_index(dir_path):
     file_index = 0
     while True:
         filename = FILE_BASE.format(file_index)
-        if os.path.isfile(pathjoin(DATA_DIR, data_name, filename)):
+        if os.path.isfile(pathjoin(dir_path, filename)):
             file_index += 1
         else:
             break
     return file_index
 
 
-def download_data(param_dict):
+def determine_resume_point(manifest, log=print):
+    """Work out where a download should carry on from, using the manifest of
+    pages already written. Returns (offset, file_index, resume_position,
+    resume_count) as used by ChunkWriter; resume_position is None if a new
+    chunk should be started. Discarded pages are reported to log."""
+    dir_path = manifest.dir_path
+
+    while True:
+        last_page = manifest.last_page()
+        if last_page is None:
+            if manifest.exists():
+                return (0, 0, None, 0)
+            # Downloaded before manifests existed. Restart from the end of
+            # the last finished chunk.
+            file_index = determine_start_index(dir_path)
+            return (file_index * FILE_ENTRY_LIMIT, file_index, None, 0)
+
+        offset = manifest.next_offset()
+        chunk_pages = [page for page in manifest.pages.values()
+                       if page["file"] == last_page["file"]]
+
+        if os.path.isfile(pathjoin(dir_path, last_page["file"])):
+            # The last chunk was finished; start the next one
+            return (offset, last_page["index"] + 1, None, 0)
+
+        partial_path = pathjoin(dir_path, PART_PREFIX + last_page["file"])
+        resume_position = last_page["start"] + last_page["bytes"]
+        if os.path.isfile(partial_path) and \
+                os.path.getsize(partial_path) >= resume_position:
+            resume_count = sum(page["count"] for page in chunk_pages)
+            return (offset, last_page["index"], resume_position, resume_count)
+
+        # The unfinished chunk is missing or shorter than recorded, so its
+        # pages have to be downloaded again
+        log(f"Discarding {len(chunk_pages)} unrecoverable pages from "
+              f"{last_page['file']}")
+        manifest.discard_pages([page["offset"] for page in chunk_pages])
+
+
+def mark_complete(dir_path):
+    completefile_path = pathjoin(dir_path,"_complete")
+    with open(completefile_path,"w") as cfile:
+        cfile.write(str(datetime.datetime.now()))
+
+
+def verify_dataset(param_dict):
+    """Check every page recorded in a dataset's manifest against the chunk
+    files on disk, without contacting the archive. Returns the offsets of
+    missing or corrupted pages."""
     data_name = create_data_name(param_dict)
-    dir_path = pathjoin(DATA_DIR, data_name)
+    manifest = DatasetManifest.load(pathjoin(DATA_DIR, data_name))
+    if not manifest.exists():
+        print(f"{data_name} - No manifest to verify")
+        return []
+
+    bad_offsets = manifest.verify()
+    if len(bad_offsets) == 0:
+        print(f"{data_name} - {len(manifest.pages)} pages "
+              f"({manifest.frame_count()} frames) verified")
+    else:
+        print(f"{data_name} - {len(bad_offsets)} / {len(manifest.pages)} "
+              f"pages failed verification: {bad_offsets}")
+    return bad_offsets
+
+
+def fetch_page(param_dict, offset, stats=None, fetch_slots=None, log=print):
+    """Request the page of frames starting at 'offset'. Returns the list of
+    frames, or None if the request failed."""
+    page_params = dict(param_dict, limit=REQUEST_ENTRY_LIMIT, offset=offset)
+    with fetch_slots or contextlib.nullcontext():
+        r = request_from_param_dict(page_params, stats, log)
+    if r is None:
+        return None
+    return r.json()['results']
+
+
+def iter_pages_serial(request_data, offset, stats=None, fetch_slots=None,
+                      log=print):
+    """Yield (offset, results) for each page by following the 'next' links
+    of the archive responses, starting from an already-requested page."""
+    while True:
+        yield offset, request_data['results']
+
+        if request_data['next'] == None:
+            return
+
+        offset += len(request_data['results'])
+        with fetch_slots or contextlib.nullcontext():
+            r = archive_get(request_data['next'], stats, log)
+        if r is None:
+            yield offset, None
+            return
+        request_data = r.json()
+
+
+def iter_pages_concurrent(param_dict, offsets, concurrency, stats=None,
+                          fetch_slots=None, log=print):
+    """Fetch the pages at each offset with a bounded pool of worker threads,
+    yielding (offset, results) in offset order. At most 2 * concurrency pages
+    are held in flight at any time."""
+    offset_iter = iter(offsets)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            for offset in itertools.islice(offset_iter, concurrency * 2):
+                pending.append((offset, executor.submit(fetch_page, param_dict,
+                                                        offset, stats,
+                                                        fetch_slots, log)))
+
+            while len(pending) > 0:
+                offset, future = pending.popleft()
+                next_offset = next(offset_iter, None)
+                if next_offset is not None:
+                    pending.append((next_offset,
+                                    executor.submit(fetch_page, param_dict,
+                                                    next_offset, stats,
+                                                    fetch_slots, log)))
+                yield offset, future.result()
+        finally:
+            # Don't wait on queued pages if the download was abandoned
+            for offset, future in pending:
+                future.cancel()
+
+
+def download_data(param_dict, concurrency=1, progress=None, fetch_slots=None,
+                  dir_path=None, fields=None):
+    """Download every frame of a dataset into its directory (by default
+    DATA_DIR/<data_name>), resuming from its manifest. If a DownloadProgress
+    is given, progress and messages are recorded on it instead of being
+    printed. fetch_slots is an optional semaphore shared between downloads to
+    cap their total number of page requests in flight. If a list of fields is
+    given, each frame is cut down to just those fields before being written;
+    a resumed download keeps the fields it was started with."""
+    data_name = create_data_name(param_dict)
+    if dir_path is None:
+        dir_path = pathjoin(DATA_DIR, data_name)
     os.makedirs(dir_path, exist_ok=True)
 
-    file_index = determine_start_index(data_name)
-    offset = file_index * FILE_ENTRY_LIMIT
+    def finish(status, message):
+        if progress is None:
+            print(message)
+        else:
+            progress.finish(status, message)
+
+    # Messages go on the dataset's progress line while a display is drawn
+    log = print if progress is None else progress.log
+
+    manifest = DatasetManifest.load(dir_path)
+    offset, file_index, resume_position, resume_count = \
+        determine_resume_point(manifest, log)
+
+    if len(manifest.pages) > 0 and fields != manifest.fields:
+        if progress is None:
+            print(f"{data_name} was started with fields {manifest.fields}; "
+                  f"continuing with those.")
+        fields = manifest.fields
+    manifest.record_fields(fields)
 
     param_dict['limit'] = REQUEST_ENTRY_LIMIT
     param_dict['offset'] = offset
 
-    r = request_from_param_dict(param_dict)
+    stats = RetryStats()
+    with fetch_slots or contextlib.nullcontext():
+        r = request_from_param_dict(param_dict, stats, log)
+    if r is None:
+        finish("failed", f"Could not start download of {data_name}.")
+        return
     request_data = r.json()
     total_count = request_data['count']
+    manifest.record_total_count(total_count)
 
-    counter = offset
-    current_counter = 0
-    temp_frame_list = []
-
-    print(f"Downloading {data_name}...")
-
-    while True:
-        sys.stdout.write("\rDownloaded {} / {} ({} files)".format(counter,
-                                                                  total_count,
-                                                                  file_index))
-        sys.stdout.flush()
-
-        if current_counter >= FILE_ENTRY_LIMIT:
-            file_path = pathjoin(dir_path, FILE_BASE.format(file_index))
-            with open(file_path,"w") as openfile:
-                openfile.write(json.dumps(temp_frame_list))
-            temp_frame_list = []
-            current_counter = 0
-            file_index += 1
-
-        results = request_data['results']
-        for frame in results:
-            temp_frame_list.append(frame)
+    if resume_position is None and file_index > 0 and offset >= total_count:
+        # Every page was written before the download was interrupted
+        mark_complete(dir_path)
+        finish("complete",
+               f"{data_name} - all {total_count} entries already downloaded")
+        return
 
-        if request_data['next'] == None:
-            break
+    if concurrency > 1:
+        # The total count is known, so every remaining page offset can be
+        # requested up front rather than following the 'next' links
+        remaining_offsets = manifest.pending_offsets(
+            offset + REQUEST_ENTRY_LIMIT, total_count, REQUEST_ENTRY_LIMIT)
+        pages = itertools.chain([(offset, request_data['results'])],
+                                iter_pages_concurrent(param_dict,
+                                                      remaining_offsets,
+                                                      concurrency, stats,
+                                                      fetch_slots, log))
+    else:
+        pages = iter_pages_serial(request_data, offset, stats, fetch_slots,
+                                  log)
 
-        next_url = request_data['next']
-        counter += REQUEST_ENTRY_LIMIT
-        current_counter += REQUEST_ENTRY_LIMIT
+    counter = offset
+    raw_bytes = 0
+    writer = ChunkWriter(dir_path, FILE_BASE, FILE_ENTRY_LIMIT, file_index,
+                         resume_position, resume_count)
 
-        r = requests.get(url=next_url)
-        if r.status_code != 200:
-            print(f"Request failed - {r.status_code}\nReason:\n{r.reason}\n")
+    if progress is None:
+        print(f"Downloading {data_name}...")
+    else:
+        progress.start(offset, total_count)
+
+    for page_offset, results in pages:
+        if results is None:
+            writer.abort()
+            finish("failed", f"Download of {data_name} stopped at offset "
+                             f"{page_offset}. Archive requests: "
+                             f"{stats.summary()}")
             return
-        request_data = r.json()
+
+        if fields is not None:
+            raw_bytes += frame_bytes(results)
+            results = project_page(results, fields)
+        page_record = writer.write_page(results)
+        manifest.record_page(page_offset, page_record)
+        counter += len(results)
+
+        if progress is None:
+            sys.stdout.write("\rDownloaded {} / {} ({} files)".format(
+                counter, total_count, writer.file_index))
+            sys.stdout.flush()
+        else:
+            progress.update(counter)
 
     # Exited Loop
-    file_path = pathjoin(dir_path, FILE_BASE.format(file_index))
-    with open(file_path,"w") as openfile:
-        openfile.write(json.dumps(temp_frame_list))
+    writer.close()
+    mark_complete(dir_path)
+
+    summary = stats.summary()
+    if fields is not None and raw_bytes > 0:
+        summary += ", {} written of {} ({:.0f}% saved)".format(
+            format_bytes(writer.bytes_written), format_bytes(raw_bytes),
+            (1 - writer.bytes_written / raw_bytes) * 100)
+
+    if progress is None:
+        print("\nDownload of {} files completed".format(total_count))
+        print(f"Archive requests: {summary}")
+    else:
+        progress.finish("complete", summary)
+
+
+def schedule_downloads(param_dicts, max_parallel=2, concurrency=4,
+                       refresh_interval=1.0, dir_paths=None, fields=None):
+    """Download several datasets at once, showing a live view of their
+    progress. Up to max_parallel datasets run at the same time, and between
+    them they never have more than 'concurrency' page requests in flight.
+    Each dataset is marked '_complete' as soon as it finishes. dir_paths
+    optionally gives the directory to download each dataset into, and fields
+    the projection applied to every frame."""
+    fetch_slots = threading.BoundedSemaphore(concurrency)
+    if dir_paths is None:
+        dir_paths = [None] * len(param_dicts)
+    progress_list = [DownloadProgress(create_data_name(param_dict))
+                     for param_dict in param_dicts]
+    display = ProgressDisplay(progress_list)
+
+    def run(param_dict, progress, dir_path):
+        try:
+            download_data(param_dict, concurrency, progress, fetch_slots,
+                          dir_path, fields)
+        except Exception as e:
+            progress.finish("failed", repr(e))
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = [executor.submit(run, param_dict, progress, dir_path)
+                   for param_dict, progress, dir_path in \
+                   zip(param_dicts, progress_list, dir_paths)]
+        while True:
+            display.draw()
+            done, not_done = wait(futures, timeout=refresh_interval)
+            if len(not_done) == 0:
+                break
+    display.draw()
+
+    return progress_list
+
+def split_time_window(start, end, shard):
+    """Split a params 'start' to 'end' range into consecutive windows of a
+    day, a week or a calendar month, returned as (start, end) strings in the
+    same format. The final window is cut short at 'end'."""
+    window_start = datetime.datetime.strptime(start, PARAM_DATE_FORMAT)
+    end_date = datetime.datetime.strptime(end, PARAM_DATE_FORMAT)
+
+    windows = []
+    while window_start < end_date:
+        if shard == "day":
+            window_end = window_start + datetime.timedelta(days=1)
+        elif shard == "week":
+            window_end = window_start + datetime.timedelta(weeks=1)
+        elif shard == "month":
+            window_end = datetime.datetime(
+                window_start.year + window_start.month // 12,
+                window_start.month % 12 + 1, 1)
+        else:
+            raise ValueError(f"Unknown shard size '{shard}'. "
+                             f"Expected one of {SHARD_SIZES}.")
+        window_end = min(window_end, end_date)
+        windows.append((window_start.strftime(PARAM_DATE_FORMAT),
+                        window_end.strftime(PARAM_DATE_FORMAT)))
+        window_start = window_end
+    return windows
+
+
+def merge_shards(dir_path, shard_dirs):
+    """Stream the frames of finished shard downloads, in order, into the
+    datafile chunks of one dataset directory, dropping any frame whose 'id'
+    has already been written (frames on a window boundary can be returned
+    for both windows). Returns (frames written, duplicates dropped)."""
+    # Clear chunks left by a previous merge that was interrupted
+    for filename in os.listdir(dir_path):
+        if filename.startswith("datafile") or filename.startswith(PART_PREFIX):
+            os.remove(pathjoin(dir_path, filename))
+
+    writer = ChunkWriter(dir_path, FILE_BASE, FILE_ENTRY_LIMIT)
+    seen_ids = set()
+    duplicates = 0
+    page = []
+    for shard_dir in shard_dirs:
+        for file_index in range(determine_start_index(shard_dir)):
+            filepath = pathjoin(shard_dir, FILE_BASE.format(file_index))
+            with open(filepath, "r") as f:
+                frames = json.load(f)
+            for frame in frames:
+                # Frames projected without their 'id' can't be deduplicated
+                frame_id = frame.get("id")
+                if frame_id is not None:
+                    if frame_id in seen_ids:
+                        duplicates += 1
+                        continue
+                    seen_ids.add(frame_id)
+                page.append(frame)
+                if len(page) >= REQUEST_ENTRY_LIMIT:
+                    writer.write_page(page)
+                    page = []
+    if len(page) > 0:
+        writer.write_page(page)
+    writer.close()
+
+    return writer.total_count, duplicates
+
+
+def download_sharded(param_dict, shard, max_parallel=SHARD_PARALLEL,
+                     concurrency=4, fields=None):
+    """Download a dataset as independent time-window shards (see
+    split_time_window), several at once, each into its own directory under
+    '<dataset>/shards/' with its own manifest and '_complete' marker. Once
+    every shard is complete they are merged into the dataset directory and
+    removed. Shards that fail are simply downloaded again on the next run,
+    without repeating the ones that finished."""
+    data_name = create_data_name(param_dict)
+    dir_path = pathjoin(DATA_DIR, data_name)
+    shards_path = pathjoin(dir_path, SHARD_DIR)
 
-    completefile_path = pathjoin(dir_path,"_complete")
-    with open(completefile_path,"w") as cfile:
-        cfile.write(str(datetime.datetime.now()))
+    if os.path.isfile(pathjoin(dir_path, "_complete")):
+        print(f"{data_name} - Complete")
+        return
+    if not os.path.isdir(shards_path) and determine_start_index(dir_path) > 0:
+        print(f"{data_name} - already partly downloaded without sharding. "
+              f"Resume it without --shard.")
+        return
+
+    shard_params = [dict(param_dict, start=start, end=end) for start, end in \
+                    split_time_window(param_dict["start"], param_dict["end"],
+                                      shard)]
+    shard_dirs = [pathjoin(shards_path, create_data_name(p))
+                  for p in shard_params]
+    pending = [(p, d) for p, d in zip(shard_params, shard_dirs)
+               if not os.path.isfile(pathjoin(d, "_complete"))]
+
+    print(f"Downloading {data_name} as {len(shard_params)} {shard} shards "
+          f"({len(shard_params) - len(pending)} already complete)...")
+    if len(pending) > 0:
+        schedule_downloads([p for p, d in pending], max_parallel, concurrency,
+                           dir_paths=[d for p, d in pending], fields=fields)
+
+    failed = [d for d in shard_dirs
+              if not os.path.isfile(pathjoin(d, "_complete"))]
+    if len(failed) > 0:
+        print(f"{len(failed)} shards of {data_name} did not complete. "
+              f"Run again to retry them.")
+        return
 
-    print("\nDownload of {} files completed".format(total_count))
+    print(f"Merging {len(shard_dirs)} shards of {data_name}...")
+    frame_count, duplicates = merge_shards(dir_path, shard_dirs)
+    shutil.rmtree(shards_path)
+    mark_complete(dir_path)
+    print(f"Merged {frame_count} frames ({duplicates} duplicates dropped)")
 
 ### Arg Parser #################################################################
 
@@ -233,10 +602,45 @@ def parse_args(cl_args):
                         help="Zip existing data and clear the data folder.")
     parser.add_argument("-i", "--info", action="store_true",
                         help="List the download status of each dataset.")
+    parser.add_argument("-v", "--verify", action="store_true",
+                        help="""Check downloaded pages against each dataset's
+                        manifest without re-downloading them.""")
     parser.add_argument("-l", "--list", action="store_true",
                            help="List all available parameter files.")
     parser.add_argument("-n", "--next", nargs="?", const=1, type=int,
                         help="Initiate the next N downloads.")
+    parser.add_argument("-c", "--concurrency", type=int, default=1,
+                        help="""Number of pages of frames to request
+                        concurrently. Defaults to 1 (follow the archive's
+                        'next' links serially). With --parallel, this is the
+                        total shared by all running datasets.""")
+    parser.add_argument("-s", "--shard", choices=SHARD_SIZES,
+                        help="""Split each dataset into day, week or month
+                        windows, download them in parallel and merge them.""")
+    parser.add_argument("-P", "--parallel", type=int, default=1,
+                        help="""Number of datasets to download at the same
+                        time, with a live view of their progress.""")
+    parser.add_argument("-p", "--pool-size", type=int,
+                        default=archive_session.DEFAULT_POOL_MAXSIZE,
+                        help="""Number of keep-alive connections to hold open
+                        to the archive. Raised to at least --concurrency.""")
+    parser.add_argument("-f", "--fields", default=None,
+                        help=f"""Only store these frame fields: a preset
+                        ({', '.join(FIELD_PRESETS)}) or a comma separated
+                        list of field names. Defaults to every field.""")
+    parser.add_argument("--project", metavar="DIR", nargs="+",
+                        help="""Rewrite the complete datasets under each
+                        directory keeping only the --fields (default
+                        'analysis'), then exit.""")
+    parser.add_argument("--parquet", action="store_true",
+                        help="""Also write a typed Parquet frame store for
+                        each dataset once it is complete (needs pyarrow).""")
+    parser.add_argument("-r", "--rate", type=float, default=None,
+                        help=f"""Maximum archive requests per second. By
+                        default requests are unlimited until the archive
+                        throttles them, then limited to {MAX_REQUEST_RATE}.
+                        The rate backs off automatically when the archive
+                        throttles requests.""")
 
     args = parser.parse_args(cl_args)
 
@@ -251,16 +655,35 @@ if __name__ == '__main__':
 
     args = parse_args(sys.argv[1:])
 
+    session = archive_session.configure_session(
+        pool_maxsize=max(args.pool_size, args.concurrency, args.parallel))
+    if args.rate is not None:
+        RETRY_POLICY.rate_limiter = TokenBucket(args.rate)
+
     if args.list:
         list_param_files()
         sys.exit()
 
+    fields = parse_fields(args.fields)
+
+    if args.project:
+        if fields is None:
+            fields = parse_fields("analysis")
+        for root_path in args.project:
+            project_datasets(root_path, fields)
+        sys.exit()
+
     param_sets = json.load(open(args.dataset_parameters, "r"))
 
     if args.info:
         dataset_status(param_sets)
         sys.exit()
 
+    if args.verify:
+        for param_dict in param_sets:
+            verify_dataset(param_dict)
+        sys.exit()
+
     if args.zip:
         zip_old_data(True)
 
@@ -281,5 +704,26 @@ if __name__ == '__main__':
     else:
         incomplete_datasets = ask_permissions(incomplete_datasets)
 
-    for param_dict in incomplete_datasets:
-        download_data(param_dict)
+    if args.shard:
+        max_parallel = args.parallel if args.parallel > 1 else SHARD_PARALLEL
+        for param_dict in incomplete_datasets:
+            download_sharded(param_dict, args.shard, max_parallel,
+                             max(args.concurrency, max_parallel), fields)
+    elif args.parallel > 1:
+        # Allow at least one request in flight per running dataset
+        schedule_downloads(incomplete_datasets, args.parallel,
+                           max(args.concurrency, args.parallel), fields=fields)
+    else:
+        for param_dict in incomplete_datasets:
+            download_data(param_dict, args.concurrency, fields=fields)
+
+    if args.parquet:
+        import frame_store
+        for param_dict in incomplete_datasets:
+            dir_path = pathjoin(DATA_DIR, create_data_name(param_dict))
+            if os.path.isfile(pathjoin(dir_path, "_complete")):
+                frame_count = frame_store.write_frame_store(dir_path)
+                print(f"Stored {frame_count} frames in "
+                      f"{frame_store.store_path(dir_path)}")
+
+    print(f"Archive connections: {session.stats.summary()}")
@@ -0,0 +1,131 @@
+import sys
+import time
+import threading
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--m --s"
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours > 0:
+        return "{}h {:0>2d}m {:0>2d}s".format(hours, minutes, seconds)
+    return "{:0>2d}m {:0>2d}s".format(minutes, seconds)
+
+
+class DownloadProgress():
+    """Progress of a single dataset download, updated by download_data and
+    read by ProgressDisplay from another thread."""
+
+    def __init__(self, data_name):
+        self.data_name = data_name
+        self.status = "queued"
+        self.message = ""
+        self.total_count = None
+        self.downloaded = 0
+        self.start_count = 0        # Frames already downloaded when started
+        self.start_time = None
+        self.end_time = None
+        self._lock = threading.Lock()
+
+    def start(self, downloaded, total_count):
+        with self._lock:
+            self.status = "downloading"
+            self.start_time = time.monotonic()
+            self.start_count = downloaded
+            self.downloaded = downloaded
+            self.total_count = total_count
+
+    def update(self, downloaded):
+        with self._lock:
+            self.downloaded = downloaded
+
+    def log(self, message):
+        """Show a message on the download's line, in place of printing it
+        through the live display."""
+        with self._lock:
+            self.message = " ".join(str(message).split())
+
+    def finish(self, status, message=""):
+        with self._lock:
+            self.status = status
+            self.message = message
+            self.end_time = time.monotonic()
+
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time if self.end_time is not None \
+            else time.monotonic()
+        return end_time - self.start_time
+
+    def rate(self):
+        """Frames downloaded per second in this run."""
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return (self.downloaded - self.start_count) / elapsed
+
+    def eta(self):
+        """Estimated seconds remaining, or None if it can't be estimated."""
+        if self.status != "downloading" or self.total_count is None:
+            return None
+        rate = self.rate()
+        if rate <= 0:
+            return None
+        return max(self.total_count - self.downloaded, 0) / rate
+
+    def line(self):
+        if self.total_count is None:
+            counts = "-"
+            percent = 0
+        else:
+            counts = f"{self.downloaded} / {self.total_count}"
+            percent = round(self.downloaded / max(self.total_count, 1) * 100)
+        line = "{}: {:>8} {} ({}%)".format(self.data_name, self.status, counts,
+                                           percent)
+        if self.status == "downloading":
+            line += ", ETA {}".format(format_duration(self.eta()))
+        if self.message:
+            line += f" - {self.message}"
+        return line
+
+
+class ProgressDisplay():
+    """A live view of several downloads, redrawn in place on the terminal:
+    one line per dataset followed by an aggregate line."""
+
+    def __init__(self, progress_list):
+        self.progress_list = progress_list
+        self.start_time = time.monotonic()
+        self.lines_drawn = 0
+
+    def aggregate_line(self):
+        downloaded = sum(p.downloaded for p in self.progress_list)
+        known_totals = [p.total_count for p in self.progress_list
+                        if p.total_count is not None]
+        finished = len([p for p in self.progress_list
+                        if p.status in ("complete", "failed")])
+        rate = sum(p.rate() for p in self.progress_list
+                   if p.status == "downloading")
+        etas = [p.eta() for p in self.progress_list]
+        eta = max([e for e in etas if e is not None], default=None)
+        return "Total: {} / {} frames, {} / {} datasets finished, " \
+               "{:.0f} frames/s, elapsed {}, ETA {}".format(
+                   downloaded, sum(known_totals), finished,
+                   len(self.progress_list), rate,
+                   format_duration(time.monotonic() - self.start_time),
+                   format_duration(eta))
+
+    def draw(self):
+        lines = [p.line() for p in self.progress_list]
+        lines.append(self.aggregate_line())
+        text = ""
+        if self.lines_drawn > 0:
+            # Move back up to the first line of the previous drawing
+            text += f"\033[{self.lines_drawn}A"
+        text += "".join(f"\r{line}\033[K\n" for line in lines)
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        self.lines_drawn = len(lines)
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import pandas as pd
+from os.path import join as pathjoin
+from concurrent.futures import ThreadPoolExecutor
+from frame_store import (datafile_list, has_frame_store, read_frame_store,
+                         compact_frame_table)
+from frame_projection import format_bytes
+from frame_transforms import parse_dates_obs
+from frame_schema import source_fields, normalize_schema
+
+# Observation time range of every datafile chunk, so that chunks which can't
+# hold frames in a requested time range are skipped without being read
+CHUNK_INDEX_NAME = "_chunk_index.json"
+
+
+def read_datafile(filepath, columns=None):
+    """Read one datafile chunk into a DataFrame under the old schema's field
+    names (see frame_schema), keeping only the given columns (those missing
+    from the chunk are left out, unless it has no frames at all)."""
+    with open(filepath, "r") as f:
+        data = json.load(f)
+    if len(data) == 0:
+        return pd.DataFrame(columns=columns)
+    if columns is None:
+        return normalize_schema(pd.DataFrame(data))
+    # Build only the wanted columns rather than a frame of every key
+    keys = set()
+    for frame in data:
+        keys.update(frame)
+    df = normalize_schema(pd.DataFrame.from_records(
+        data, columns=[c for c in source_fields(columns) if c in keys]))
+    return df[[c for c in columns if c in df.columns]]
+
+
+def observation_times(df):
+    """The observation times of a frame table, parsing DATE_OBS if it has
+    not been already."""
+    if 'datetime' in df.columns:
+        return df['datetime']
+    return parse_dates_obs(df['DATE_OBS'], verbose=False)
+
+
+def frame_mask(df, start=None, end=None, propids=None, obstypes=None):
+    """Rows of a frame table observed from start up to (not including) end,
+    under one of propids and of one of obstypes. None matches anything."""
+    mask = pd.Series(True, index=df.index)
+    if start is not None or end is not None:
+        times = observation_times(df)
+        if start is not None:
+            mask &= times >= pd.Timestamp(start)
+        if end is not None:
+            mask &= times < pd.Timestamp(end)
+    if propids is not None:
+        mask &= df['PROPID'].isin(propids)
+    if obstypes is not None:
+        mask &= df['OBSTYPE'].isin(obstypes)
+    return mask
+
+
+def load_chunk_index(dir_path):
+    try:
+        with open(pathjoin(dir_path, CHUNK_INDEX_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def save_chunk_index(dir_path, chunk_index):
+    path = pathjoin(dir_path, CHUNK_INDEX_NAME)
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump(chunk_index, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        # A read-only dataset is still loaded, just without the index
+        pass
+
+
+def chunk_entry(filepath, df):
+    """A chunk index entry of a chunk's size, modification time and the
+    range of its observation times (None if it has none)."""
+    stat = os.stat(filepath)
+    times = observation_times(df).dropna() if len(df) > 0 else \
+        pd.Series([])
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "start": times.min().isoformat() if len(times) > 0 else None,
+        "end": times.max().isoformat() if len(times) > 0 else None
+    }
+
+
+def entry_is_current(entry, filepath):
+    """True if a chunk index entry was made from the file as it is now."""
+    if entry is None:
+        return False
+    stat = os.stat(filepath)
+    return [entry["size"], entry["mtime_ns"]] == [stat.st_size,
+                                                  stat.st_mtime_ns]
+
+
+def chunk_may_match(entry, filepath, start=None, end=None):
+    """False if a chunk index entry, still current for its file, shows that
+    the chunk holds no frames from start up to end."""
+    if not entry_is_current(entry, filepath):
+        return True
+    if entry["start"] is None:
+        return False
+    if start is not None and pd.Timestamp(entry["end"]) < pd.Timestamp(start):
+        return False
+    if end is not None and pd.Timestamp(entry["start"]) >= pd.Timestamp(end):
+        return False
+    return True
+
+
+def store_filters(start=None, end=None, propids=None, obstypes=None):
+    """The predicates as pyarrow filters on the frame store's columns."""
+    filters = []
+    if start is not None:
+        filters.append(('datetime', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('datetime', '<', pd.Timestamp(end)))
+    if propids is not None:
+        filters.append(('PROPID', 'in', list(propids)))
+    if obstypes is not None:
+        filters.append(('OBSTYPE', 'in', list(obstypes)))
+    return filters or None
+
+
+def load_frames(dir_path, columns=None, workers=1, verbose=True, start=None,
+                end=None, propids=None, obstypes=None, compact=False):
+    """
+    Load every frame of a dataset directory into a single DataFrame with a
+    clean RangeIndex, reading its frame store if it has an up to date one
+    and otherwise its datafile chunks in index order.
+        columns - only load these columns
+        workers - number of threads reading chunk files at once
+        verbose - print the number of frames, load time and memory used
+        start, end - only load frames observed from start up to end
+        propids, obstypes - only load frames with one of these PROPIDs or
+            OBSTYPEs
+        compact - return a compact frame table (see compact_frame_table)
+
+    The predicates are applied as each chunk is read, and chunks whose
+    recorded time range (see CHUNK_INDEX_NAME) is outside start to end are
+    not read at all. The frame store is read with the predicates as
+    filters, skipping any row groups that can't match.
+    """
+    start_time = time.perf_counter()
+    predicates = dict(start=start, end=end, propids=propids,
+                      obstypes=obstypes)
+    filtered = any(value is not None for value in predicates.values())
+
+    # Columns the predicates need, whether or not they are to be returned
+    read_columns = columns
+    if columns is not None and filtered:
+        needed = [c for c, value in [('DATE_OBS', start or end),
+                                     ('datetime', start or end),
+                                     ('PROPID', propids),
+                                     ('OBSTYPE', obstypes)]
+                  if value is not None]
+        read_columns = list(columns) + [c for c in needed if c not in columns]
+
+    if has_frame_store(dir_path):
+        source = "frame store"
+        df = read_frame_store(dir_path, read_columns,
+                              filters=store_filters(**predicates))
+    else:
+        chunk_index = load_chunk_index(dir_path) if filtered else {}
+        index_changed = False
+        filepaths = [pathjoin(dir_path, f) for f in datafile_list(dir_path)]
+        if start is not None or end is not None:
+            filepaths = [filepath for filepath in filepaths if chunk_may_match(
+                chunk_index.get(os.path.basename(filepath)), filepath,
+                start, end)]
+        source = f"{len(filepaths)} files"
+
+        def read_chunk(filepath):
+            nonlocal index_changed
+            df = read_datafile(filepath, read_columns)
+            if not filtered:
+                return df
+            filename = os.path.basename(filepath)
+            if 'DATE_OBS' in df.columns and \
+                    not entry_is_current(chunk_index.get(filename), filepath):
+                chunk_index[filename] = chunk_entry(filepath, df)
+                index_changed = True
+            return df[frame_mask(df, **predicates)]
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                dataframes = list(executor.map(read_chunk, filepaths))
+        else:
+            dataframes = [read_chunk(filepath) for filepath in filepaths]
+        if index_changed:
+            save_chunk_index(dir_path, chunk_index)
+
+        # Concatenate once at the end rather than growing the frame per file,
+        # leaving out empty chunks unless there is nothing else
+        dataframes = [d for d in dataframes if len(d) > 0] or dataframes[:1]
+        if len(dataframes) > 0:
+            df = pd.concat(dataframes, axis=0, ignore_index=True)
+        else:
+            df = pd.DataFrame(columns=read_columns)
+
+    if read_columns is not columns:
+        df = df[[c for c in columns if c in df.columns]]
+    df = df.reset_index(drop=True)
+    if compact:
+        df = compact_frame_table(df, verbose)
+
+    if verbose:
+        load_time = time.perf_counter() - start_time
+        memory = df.memory_usage(index=True, deep=True).sum()
+        print(f"Loaded {len(df)} frames from {source} in {load_time:.2f}s "
+              f"({format_bytes(memory)} in memory)")
+    return df
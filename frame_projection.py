@@ -0,0 +1,113 @@
+import os
+import json
+from os.path import join as pathjoin
+from dataset_manifest import MANIFEST_NAME
+from frame_schema import FIELD_ALIASES
+
+# Frame fields read by the analysis in get_dataframe_lco_default.py (the
+# source fields of its desired_columns plus 'area' for the centroids), along
+# with the identifiers used to check and merge datasets.
+ANALYSIS_FIELDS = ['id', 'DATE_OBS', 'BLKUID', 'EXPTIME', 'FILTER', 'INSTRUME',
+                   'OBJECT', 'OBSTYPE', 'PROPID', 'REQNUM', 'RLEVEL', 'SITEID',
+                   'TELID', 'area']
+
+FIELD_PRESETS = {
+    "analysis": ANALYSIS_FIELDS,
+}
+
+
+def parse_fields(fields):
+    """Turn a preset name or a comma separated list of field names into a
+    list of fields. Returns None (keep every field) for None or 'all'."""
+    if fields is None or fields == "all":
+        return None
+    if fields in FIELD_PRESETS:
+        return list(FIELD_PRESETS[fields])
+    return [f.strip() for f in fields.split(",") if f.strip() != ""]
+
+
+def project_frame(frame, fields):
+    """A copy of a frame keeping only the given fields that it has, or their
+    newer schema equivalents (see frame_schema) if it only has those."""
+    projected = {}
+    for field in fields:
+        if field in frame:
+            projected[field] = frame[field]
+        elif FIELD_ALIASES.get(field) in frame:
+            projected[FIELD_ALIASES[field]] = frame[FIELD_ALIASES[field]]
+    return projected
+
+
+def project_page(frames, fields):
+    if fields is None:
+        return frames
+    return [project_frame(frame, fields) for frame in frames]
+
+
+def frame_bytes(frames):
+    """Size of a page of frames as written to a datafile chunk."""
+    if len(frames) == 0:
+        return 0
+    return sum(len(json.dumps(frame)) for frame in frames) + \
+        2 * (len(frames) - 1)
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} {unit}"
+        n /= 1024.
+
+
+def project_dataset(dir_path, fields):
+    """Rewrite the finished datafile chunks of an existing dataset directory
+    keeping only the given fields. Each chunk is replaced atomically, so an
+    interrupted conversion can simply be run again. Returns (bytes before,
+    bytes after)."""
+    if not os.path.isfile(pathjoin(dir_path, "_complete")):
+        print(f"{dir_path} - Not complete, skipping projection")
+        return 0, 0
+
+    bytes_before = 0
+    bytes_after = 0
+    for filename in sorted(os.listdir(dir_path)):
+        if not (filename.startswith("datafile") and filename.endswith(".json")):
+            continue
+        filepath = pathjoin(dir_path, filename)
+        bytes_before += os.path.getsize(filepath)
+        with open(filepath, "r") as f:
+            frames = json.load(f)
+
+        temp_path = filepath + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(project_page(frames, fields), f)
+        os.replace(temp_path, filepath)
+        bytes_after += os.path.getsize(filepath)
+
+    # Page checksums in the manifest no longer match the rewritten chunks
+    manifest_path = pathjoin(dir_path, MANIFEST_NAME)
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+
+    return bytes_before, bytes_after
+
+
+def project_datasets(root_path, fields):
+    """Project every complete dataset directory found under root_path."""
+    total_before = 0
+    total_after = 0
+    for root, dirs, files in os.walk(root_path):
+        dirs.sort()
+        if "_complete" not in files:
+            continue
+        bytes_before, bytes_after = project_dataset(root, fields)
+        total_before += bytes_before
+        total_after += bytes_after
+        print(f"{root}: {format_bytes(bytes_before)} -> "
+              f"{format_bytes(bytes_after)}")
+
+    if total_before > 0:
+        print(f"Projected {format_bytes(total_before)} to "
+              f"{format_bytes(total_after)} "
+              f"({(1 - total_after / total_before) * 100:.0f}% saved)")
+    return total_before, total_after
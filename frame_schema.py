@@ -0,0 +1,57 @@
+# Fields of the newer archive schema, by the name the analysis code (and the
+# older schema) uses for them. Frames downloaded in the changeover period
+# hold both, with the same values.
+FIELD_ALIASES = {
+    'DATE_OBS': 'observation_date',
+    'DAY_OBS': 'observation_day',
+    'BLKUID': 'observation_id',
+    'REQNUM': 'request_id',
+    'RLEVEL': 'reduction_level',
+    'PROPID': 'proposal_id',
+    'OBSTYPE': 'configuration_type',
+    'EXPTIME': 'exposure_time',
+    'FILTER': 'primary_optical_element',
+    'INSTRUME': 'instrument_id',
+    'OBJECT': 'target_name',
+    'SITEID': 'site_id',
+    'TELID': 'telescope_id',
+    'L1PUBDAT': 'public_date',
+}
+
+
+def source_fields(columns):
+    """The raw frame fields to read to build the given columns from frames
+    in either schema."""
+    return list(columns) + [FIELD_ALIASES[c] for c in columns
+                            if c in FIELD_ALIASES and
+                            FIELD_ALIASES[c] not in columns]
+
+
+def normalize_schema(df):
+    """
+    Map a frame table in the old or the new archive schema, or a mix of the
+    two (such as chunks of each concatenated together), onto the old field
+    names, working a column at a time:
+        - new fields whose old field is absent are renamed to it
+        - where both are present, missing old values are taken from the new
+          field, which is then dropped
+    """
+    aliases = {column: alias for column, alias in FIELD_ALIASES.items()
+               if alias in df.columns}
+    if len(aliases) == 0:
+        return df
+
+    renames = {}
+    filled = {}
+    for column, alias in aliases.items():
+        if column not in df.columns:
+            renames[alias] = column
+            continue
+        missing = df[column].isna()
+        if missing.any():
+            filled[column] = df[column].where(~missing, df[alias])
+
+    df = df.assign(**filled)
+    df = df.drop(columns=[alias for alias in aliases.values()
+                          if alias not in renames])
+    return df.rename(columns=renames)
@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+from os.path import join as pathjoin
+from frame_transforms import parse_dates_obs
+from frame_schema import normalize_schema
+from frame_projection import format_bytes
+
+STORE_NAME = "frames.parquet"
+
+# Column types of the frame table. Fields not listed here are stored as
+# whatever type pyarrow infers for them.
+DATETIME_COLUMNS = {'DATE_OBS': 'datetime'}     # Source column: typed column
+FLOAT_COLUMNS = ['EXPTIME']
+INTEGER_COLUMNS = ['id', 'BLKUID', 'REQNUM', 'RLEVEL']
+CATEGORY_COLUMNS = ['PROPID', 'OBJECT', 'INSTRUME', 'FILTER', 'OBSTYPE',
+                    'SITEID', 'TELID']
+
+
+def _import_parquet():
+    # pyarrow is only needed for the columnar store, so it is imported when
+    # first used rather than being required by everything that imports this
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The Parquet frame store requires pyarrow "
+                          "(pip install pyarrow, or the 'parquet' extra).")
+    return pyarrow
+
+
+def datafile_list(dir_path):
+    """The finished datafile chunks of a dataset directory, in index order."""
+    datafiles = [f for f in os.listdir(dir_path)
+                 if f.startswith('datafile') and f.endswith('.json')]
+    return sorted(datafiles, key=lambda f: int(f.split('_')[-1].split('.')[0]))
+
+
+def store_path(dir_path):
+    return pathjoin(dir_path, STORE_NAME)
+
+
+def has_frame_store(dir_path):
+    """True if the dataset has a frame store at least as new as every one of
+    its datafile chunks, so that it can be read instead of them."""
+    path = store_path(dir_path)
+    if not os.path.isfile(path):
+        return False
+    store_mtime = os.path.getmtime(path)
+    return all(os.path.getmtime(pathjoin(dir_path, f)) <= store_mtime
+               for f in datafile_list(dir_path))
+
+
+def type_frame_table(df):
+    """Give the known columns of a frame table their proper dtypes: parsed
+    observation times, floats, integers (float if there are missing values)
+    and categories for the repetitive string fields."""
+    for column, datetime_column in DATETIME_COLUMNS.items():
+        if column in df.columns and datetime_column not in df.columns:
+            df[datetime_column] = parse_dates_obs(df[column])
+    for column in FLOAT_COLUMNS + INTEGER_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def downcast(values):
+    """A numeric Series as int32 if every value is a whole number that fits,
+    or as float32 if that holds every value exactly, otherwise unchanged."""
+    known = values.dropna()
+    if values.dtype.kind not in 'fiu' or len(known) == 0:
+        return values
+    int32 = np.iinfo(np.int32)
+    if len(known) == len(values) and (known % 1 == 0).all() and \
+            known.min() >= int32.min and known.max() <= int32.max:
+        return values.astype(np.int32)
+    if (known.astype(np.float32).astype(known.dtype) == known).all():
+        return values.astype(np.float32)
+    return values
+
+
+def compact_frame_table(df, verbose=True):
+    """
+    Type a frame table (see type_frame_table) and shrink its numeric columns
+    to 32 bits wherever that keeps their values exact, so that several years
+    of frames fit in memory and group by faster. If verbose, the memory used
+    before and after is printed.
+    """
+    before = df.memory_usage(index=True, deep=True).sum()
+    df = type_frame_table(df)
+    for column in FLOAT_COLUMNS + INTEGER_COLUMNS:
+        if column in df.columns:
+            df[column] = downcast(df[column])
+    if verbose:
+        after = df.memory_usage(index=True, deep=True).sum()
+        print(f"Compacted frame table from {format_bytes(before)} to "
+              f"{format_bytes(after)}")
+    return df
+
+
+def uncategorize(df):
+    """Turn a frame table's categorical columns back into plain strings, so
+    that grouping by them only gives the values present."""
+    categories = [c for c in df.columns
+                  if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    return df.astype({c: object for c in categories}) if categories else df
+
+
+def _to_arrow(df):
+    pa = _import_parquet()
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    # Fall back to JSON text for any column pyarrow can't store as it is
+    # (e.g. one mixing strings and numbers across schema versions)
+    df = df.copy()
+    for column in df.columns:
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[column] = df[column].apply(
+                lambda x: None if x is None else json.dumps(x))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_frame_store(dir_path):
+    """Convert the datafile chunks of a dataset directory, in either archive
+    schema, into a typed Parquet frame store written alongside them.
+    Returns the number of frames stored."""
+    pa = _import_parquet()
+
+    frames = []
+    for datafile in datafile_list(dir_path):
+        with open(pathjoin(dir_path, datafile), "r") as f:
+            frames += json.load(f)
+    df = type_frame_table(normalize_schema(pd.DataFrame(frames)))
+
+    # Write then rename, so that a partly written store is never read
+    temp_path = store_path(dir_path) + ".tmp"
+    pa.parquet.write_table(_to_arrow(df), temp_path, compression='zstd')
+    os.replace(temp_path, store_path(dir_path))
+    return len(df)
+
+
+def read_frame_store(dir_path, columns=None, filters=None):
+    """Read a dataset's frame store, or just the given columns of it.
+    filters are pyarrow row filters, such as [('PROPID', 'in', [...])];
+    those on columns missing from the store are ignored."""
+    pa = _import_parquet()
+    schema = pa.parquet.read_schema(store_path(dir_path))
+    if columns is not None:
+        columns = [c for c in columns if c in schema.names]
+    if filters is not None:
+        filters = [f for f in filters if f[0] in schema.names] or None
+    return pd.read_parquet(store_path(dir_path), columns=columns,
+                           filters=filters, engine='pyarrow')
+
+
+def convert_datasets(root_path, force=False):
+    """Write a frame store for every complete dataset under root_path that
+    does not already have an up to date one."""
+    for root, dirs, files in os.walk(root_path):
+        dirs.sort()
+        if "_complete" not in files:
+            continue
+        if has_frame_store(root) and not force:
+            print(f"{root} - Up to date")
+            continue
+        frame_count = write_frame_store(root)
+        json_bytes = sum(os.path.getsize(pathjoin(root, f))
+                         for f in datafile_list(root))
+        print(f"{root} - {frame_count} frames, {json_bytes} bytes of JSON "
+              f"stored in {os.path.getsize(store_path(root))} bytes")
+
+################################################################################
+
+if __name__ == '__main__':
+    for root_path in sys.argv[1:]:
+        convert_datasets(root_path)
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+# The formats of archive DATE_OBS strings, tried in order
+DATE_OBS_FORMATS = ["%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"]
+
+# Character layouts of the DATE_OBS strings the archive actually returns,
+# 'd' standing for any digit. These are parsed straight from their bytes.
+DATE_OBS_LAYOUTS = ["dddd-dd-ddTdd:dd:dd.ddddddZ", "dddd-dd-ddTdd:dd:ddZ"]
+DATE_OBS_WIDTH = max(len(layout) for layout in DATE_OBS_LAYOUTS)
+
+
+def _matches_layout(chars, layout):
+    """Rows of a (rows, width) byte matrix that follow a character layout."""
+    match = np.ones(len(chars), dtype=bool)
+    for i in range(chars.shape[1]):
+        if i >= len(layout):
+            match &= chars[:, i] == 0
+        elif layout[i] == 'd':
+            match &= (chars[:, i] >= ord('0')) & (chars[:, i] <= ord('9'))
+        else:
+            match &= chars[:, i] == ord(layout[i])
+    return match
+
+
+def _parse_fixed_width(dates):
+    """Parse the DATE_OBS strings that follow one of DATE_OBS_LAYOUTS from a
+    byte matrix, without any per-row Python. Returns the datetime64[ns]
+    values and a mask of the rows that were parsed."""
+    try:
+        # One spare byte, so that longer strings can be told apart
+        raw = dates.to_numpy(dtype=f'S{DATE_OBS_WIDTH + 1}')
+    except UnicodeEncodeError:
+        return None, np.zeros(len(dates), dtype=bool)
+    chars = raw.view(np.uint8).reshape(len(raw), DATE_OBS_WIDTH + 1)
+
+    with_fraction = _matches_layout(chars, DATE_OBS_LAYOUTS[0])
+    parsed = with_fraction | _matches_layout(chars, DATE_OBS_LAYOUTS[1])
+
+    try:
+        seconds = np.ascontiguousarray(chars[:, :19]).view('S19').ravel()
+        seconds = np.where(parsed, seconds, b'NaT').astype('datetime64[s]')
+    except ValueError:
+        # Out of range fields such as a 13th month; leave them to strptime
+        return None, np.zeros(len(dates), dtype=bool)
+
+    digits = chars[:, 20:26].astype(np.int64) - ord('0')
+    microseconds = digits @ np.array([100000, 10000, 1000, 100, 10, 1])
+    microseconds = np.where(with_fraction, microseconds, 0)
+    values = seconds.astype('datetime64[ns]') + \
+        microseconds.astype('timedelta64[us]')
+    return values, parsed
+
+
+def parse_dates_obs(dates, verbose=True):
+    """
+    Convert a Series of DATE_OBS strings to datetime64, giving the same
+    values as applying str_to_datetime to each row. Strings in the archive's
+    usual fixed-width layouts are parsed together from their bytes, and any
+    others with pandas' strptime for each format. Values matching neither
+    format become NaT rather than raising; if verbose, the number of them is
+    printed.
+    """
+    dates = pd.Series(dates).astype(object)
+    values, parsed = _parse_fixed_width(dates)
+    result = pd.Series(values if values is not None else pd.NaT,
+                       index=dates.index, dtype='datetime64[ns]')
+
+    for date_format in DATE_OBS_FORMATS:
+        unparsed = result.isna() & dates.notna()
+        if not unparsed.any():
+            break
+        result[unparsed] = pd.to_datetime(dates[unparsed], format=date_format,
+                                          errors='coerce')
+
+    unparseable = int((result.isna() & dates.notna()).sum())
+    if verbose and unparseable > 0:
+        print(f"{unparseable} unparseable DATE_OBS values set to NaT")
+    return result
+
+
+def area_centroids(areas, wrap_ra=True):
+    """
+    RA and Dec centroids of the frame footprints in a Series of 'area'
+    polygons, as a DataFrame with 'RA' (0 to 360) and 'DEC' columns on the
+    same index. Frames without an area get NaN. If not wrap_ra, RA is left
+    in the corners' own convention (-180 to 180 in the archive), as in
+    get_dataframe_lco, with only the footprints straddling it brought into
+    -180 to 180.
+
+    Like get_centroid this is the mean of the polygon's listed corners, but
+    the corners of every frame are stacked into one array per polygon size
+    and averaged together, and footprints straddling RA 0/360 are unwrapped
+    first rather than averaging to the wrong side of the sky.
+    """
+    areas = pd.Series(areas)
+    rings = []
+    for area in areas:
+        try:
+            ring = area.get('coordinates')[0]
+        except (AttributeError, TypeError, IndexError):
+            ring = None
+        rings.append(ring if ring is not None else [])
+    counts = np.array([len(ring) for ring in rings], dtype=np.int64)
+
+    ra = np.full(len(areas), np.nan)
+    dec = np.full(len(areas), np.nan)
+    # Footprints are almost always the same closed 5 point polygon, so this
+    # is usually a single (frames, corners, 2) array
+    for count in np.unique(counts[counts > 0]):
+        rows = np.flatnonzero(counts == count)
+        # Rings read from a frame store are object arrays of corner arrays,
+        # so each corner is made a plain list before stacking
+        corners = np.array([[list(corner) for corner in rings[i]]
+                            for i in rows], dtype=float)
+        corner_ra = corners[:, :, 0]
+
+        mean_ra = corner_ra.mean(axis=1)
+        span = corner_ra.max(axis=1) - corner_ra.min(axis=1)
+        # Measure every corner relative to the first corner of its footprint
+        offsets = (corner_ra - corner_ra[:, :1] + 180) % 360 - 180
+        unwrapped_ra = corner_ra[:, 0] + offsets.mean(axis=1)
+
+        if wrap_ra:
+            ra[rows] = np.where(span > 180, unwrapped_ra, mean_ra) % 360
+        else:
+            ra[rows] = np.where(span > 180, (unwrapped_ra + 180) % 360 - 180,
+                                mean_ra)
+        dec[rows] = corners[:, :, 1].mean(axis=1)
+
+    return pd.DataFrame({'RA': ra, 'DEC': dec}, index=areas.index)
+
+
+def reduce_to_best_frames(df, key='datetime', verbose=True):
+    """
+    Keep one frame per exposure (rows sharing the same key): the first, in
+    row order, of those with the highest RLEVEL. Rows come back sorted by key
+    with their original index, as from the per-group loop in reduce_frames,
+    but are picked with one grouped max over the whole table. If verbose,
+    the number of exposures with several frames at their highest RLEVEL
+    (ties, broken by row order) is printed.
+    """
+    frames = df[df[key].notna()]
+    best_rlevel = frames.groupby(key, sort=False)['RLEVEL'].transform('max')
+    candidates = frames[frames['RLEVEL'] == best_rlevel]
+
+    repeated = candidates.duplicated(key, keep='first')
+    if verbose:
+        ties = candidates.loc[repeated, key].nunique()
+        if ties > 0:
+            print(f"{ties} exposures had several frames at their highest "
+                  f"RLEVEL; kept the first of each")
+    return candidates[~repeated].sort_values(key, kind='stable')
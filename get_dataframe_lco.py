@@ -7,28 +7,18 @@ from numpy import mean, std, floor, log10
 import plotly.offline as py
 import plotly.graph_objs as go
 
+from frame_loader import load_frames
+from quality_rules import RULES, apply_rules, print_quarantine
+from frame_transforms import (parse_dates_obs, area_centroids,
+    reduce_to_best_frames)
+
 desired_columns = ['datetime','BLKUID','EXPTIME','FILTER','INSTRUME','OBJECT',
     'OBSTYPE','PROPID','REQNUM','RLEVEL','RA','DEC']
 
-def merge_datasets(dir_path):
+def merge_datasets(dir_path,columns=None,workers=1,**predicates):
     print("Loading Dataframe...")
-    dir_path = pathjoin(dir_path,'working_data')
-    datafile_list = filter(lambda x: x.startswith('data'),os.listdir(dir_path))
-
-    df = None
-
-    for datafile in datafile_list:
-        filepath = pathjoin(dir_path,datafile)
-        data = json.load(open(filepath,"r"))
-        new_dataframe = pd.DataFrame(data)
-
-        if type(df) == type(None):
-            df = new_dataframe
-        else:
-            df = pd.concat([df,new_dataframe],axis=0)
-
-    df.reset_index()
-    return df
+    return load_frames(pathjoin(dir_path,'working_data'),columns,workers,
+        **predicates)
 
 def str_to_datetime(date_str):
     try:
@@ -37,8 +27,11 @@ def str_to_datetime(date_str):
         return dt.datetime.strptime(date_str,"%Y-%m-%dT%H:%M:%SZ")
 
 def convert_dates_obs(df):
+    if 'datetime' in df.columns:
+        # Already parsed by the frame store
+        return df
     print("Converting DATE_OBS values to datetime objects...")
-    df['datetime'] = df['DATE_OBS'].apply(str_to_datetime)
+    df['datetime'] = parse_dates_obs(df['DATE_OBS'])
     return df
 
 def get_centroid(area):
@@ -46,7 +39,7 @@ def get_centroid(area):
         coordinates = area.get('coordinates')[0]
     except:
         return pd.Series((None,None))
-    if coordinates == None:
+    if coordinates is None:
         return None
     ra = []
     dec = []
@@ -57,7 +50,7 @@ def get_centroid(area):
 
 def add_ra_dec(df):
     print("Converting Areas to RA and DEC...")
-    df[['RA','DEC']] = df['area'].apply(get_centroid)
+    df[['RA','DEC']] = area_centroids(df['area'], wrap_ra=False)
     return df
 
 def extract_additional_information(df):
@@ -73,13 +66,9 @@ def remove_unnecessary_columns(df):
 
 def reduce_frames(df):
     print("Reducing frames...")
-    obs_groups = df.groupby('datetime')
-    expected_frames = len(obs_groups)
+    expected_frames = df['datetime'].nunique()
 
-    new_df = pd.concat([
-        obs_frames[ obs_frames['RLEVEL'] == obs_frames['RLEVEL'].max() ].head(1)
-        for d, obs_frames in obs_groups ]
-    )
+    new_df = reduce_to_best_frames(df)
 
     resultant_frames = len(new_df)
     if resultant_frames != expected_frames:
@@ -192,22 +181,25 @@ def split_into_user_requests(df):
 def obtain_requests(raw_df):
     # Get centroids from visual areas
     # raw_df['centroid'] = raw_df['area'].apply(get_centroid)
-    raw_df[['RA','DEC']] = raw_df['area'].apply(get_centroid)
+    raw_df[['RA','DEC']] = area_centroids(raw_df['area'], wrap_ra=False)
     # Get Datetime object from DATE_OBS
-    raw_df['datetime'] = raw_df['DATE_OBS'].apply(str_to_datetime)
+    if 'datetime' not in raw_df.columns:
+        raw_df['datetime'] = parse_dates_obs(raw_df['DATE_OBS'])
     # Strip unnecessary Information
     desired_columns = ['datetime','EXPTIME','FILTER','INSTRUME','OBJECT',
         'OBSTYPE','PROPID','REQNUM','RLEVEL','RA','DEC']
     select_df = raw_df[ desired_columns ]
 
+    # Leave out requests with more than 1 propID, and observations with
+    # multiple values of a parameter, rather than giving up on every request
+    select_df, quarantine = apply_rules(select_df, [rule for rule in RULES
+        if rule['name'] in ['single_propid_per_request', 'homogeneous_exposure']])
+    print_quarantine(quarantine)
+
     proposals = {}
 
     for reqnum, r_group in select_df.groupby('REQNUM'):
-        propid_list = list(r_group['PROPID'].unique())
-        if len(propid_list) > 1:
-            print("ERROR! - Request group with more than 1 propID")
-            return
-        propid = propid_list[0]
+        propid = r_group['PROPID'].iloc[0]
         observation_list = []
 
         for start_date, o_group in r_group.groupby('datetime'):
@@ -217,11 +209,7 @@ def obtain_requests(raw_df):
             # Extract identical parameters
             identical_cols = ['EXPTIME','FILTER','INSTRUME','OBJECT','OBSTYPE']
             for key in identical_cols:
-                val_list = list(obs_set[key].unique())
-                if len(val_list) > 1:
-                    print("Unexpected multiple values for '{}' for a single observation".format(key))
-                    return
-                obs_params[key] = val_list[0]
+                obs_params[key] = obs_set[key].iloc[0]
             # Extract centroid
             obs_params['RA'] = obs_set['RA'].mean(skipna=True)
             obs_params['DEC'] = obs_set['DEC'].mean(skipna=True)
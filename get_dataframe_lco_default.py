@@ -2,30 +2,27 @@ import json, os, sys, re
 import pandas as pd
 import datetime as dt
 from os.path import join as pathjoin
-from numpy import mean, std, floor, log10, finfo
+from numpy import mean, std, floor, log10, finfo, zeros
 from download_datasets_lco import create_data_name
+from frame_loader import load_frames
+from frame_store import uncategorize
+from block_extraction import extract_blocks, frame_times, intrablock_gaps
+from frame_transforms import (parse_dates_obs, area_centroids,
+    reduce_to_best_frames)
+from quality_rules import apply_rules, print_quarantine
+from stage_cache import dataset_checksum, code_version, stage_key, cached_stage
+import frame_loader, frame_store, frame_schema, frame_transforms
+import quality_rules, block_extraction, patterns
 
 desired_columns = ['datetime','BLKUID','EXPTIME','FILTER','INSTRUME','OBJECT',
     'OBSTYPE','PROPID','REQNUM','RLEVEL','RA','DEC']
 
-def merge_datasets(dir_path):
-    dir_path = pathjoin(dir_path)
-    datafile_list = filter(lambda x: x.startswith('data'),os.listdir(dir_path))
+# Columns read from the frame store to build desired_columns
+source_columns = ['datetime','DATE_OBS','area','BLKUID','EXPTIME','FILTER',
+    'INSTRUME','OBJECT','OBSTYPE','PROPID','REQNUM','RLEVEL']
 
-    df = None
-
-    for datafile in datafile_list:
-        filepath = pathjoin(dir_path,datafile)
-        data = json.load(open(filepath,"r"))
-        new_dataframe = pd.DataFrame(data)
-
-        if type(df) == type(None):
-            df = new_dataframe
-        else:
-            df = pd.concat([df,new_dataframe],axis=0)
-
-    df.reset_index()
-    return df
+def merge_datasets(dir_path,columns=None,workers=1,**predicates):
+    return load_frames(pathjoin(dir_path),columns,workers,**predicates)
 
 def str_to_datetime(date_str):
     try:
@@ -38,7 +35,7 @@ def get_centroid(area):
         coordinates = area.get('coordinates')[0]
     except:
         return pd.Series((None,None))
-    if coordinates == None:
+    if coordinates is None:
         return None
     ra = []
     dec = []
@@ -57,13 +54,9 @@ def fill_empty_proposal(input_str):
         return input_str
 
 def reduce_frames(df):
-    obs_groups = df.groupby('datetime')
-    expected_frames = len(obs_groups)
+    expected_frames = df['datetime'].nunique()
 
-    new_df = pd.concat([
-        obs_frames[ obs_frames['RLEVEL'] == obs_frames['RLEVEL'].max() ].head(1)
-        for d, obs_frames in obs_groups ]
-    )
+    new_df = reduce_to_best_frames(df)
 
     resultant_frames = len(new_df)
     if resultant_frames != expected_frames:
@@ -76,17 +69,15 @@ def is_science_propid(propid):
 
 def get_largest_intrablock_gap(df):
     # Sort rows based on start time
-    # Iterate over rows, get gaps
+    # Get the gaps between each frame's end and the next frame's start
     # Retain largest gap
     sdf = df.sort_values('datetime')
-    largest_gap = 0
-    for i in range(len(sdf)-1):
-        current_ending = sdf.datetime.iloc[i] + dt.timedelta(\
-            seconds=float(sdf.EXPTIME.iloc[i]))
-        gap = (sdf.datetime.iloc[i+1] - current_ending).total_seconds()
-        if gap > largest_gap:
-            largest_gap = gap
-    return largest_gap
+    start_ns, exposure_us = frame_times(sdf)
+    gaps = intrablock_gaps(start_ns, exposure_us, zeros(len(sdf), dtype=int))
+    gaps = gaps[gaps > 0]
+    if len(gaps) == 0:
+        return 0
+    return gaps.max()
 
 def get_pattern(block):
     l1 = len(block)
@@ -253,28 +244,23 @@ def list_datasets(select=False):
             datasets.append(pathjoin(type,filename))
     return datasets
 
-def setup(data_name='lco/coj_2m0a_2016-02-01_2016-08-01',return_raw=False):
-    data_path = os.path.join("data2", data_name)
-
-    # data_path = os.path.join("data2", "lco", "coj_2m0a_2016-02-01_2016-08-01")
-    if not os.path.isdir(data_path):
-        print("Could not find relative directory '{}'".format(data_path))
-        return
-    if not os.path.isfile(pathjoin(data_path,'_complete')):
-        print("Data at relative directory '{}' does not have '_complete' file".format(
-            data_path))
-
-    # Data exists
-    print("Printing all graphs for data in '{}'...".format(data_name))
-
-    print("Loading Dataframe...")
-    raw = merge_datasets(data_path)
-
-    print("Converting dates to datetime objects...")
-    raw['datetime'] = raw['DATE_OBS'].apply(str_to_datetime)
+def prepare_frames(raw):
+    # Returns the prepared frames and the quarantine table of frames that
+    # broke a data quality rule (see quality_rules)
+    if len(raw) == 0:
+        # A dataset without frames has no fields to take columns from
+        raw = raw.reindex(columns=list(raw.columns) +
+            [c for c in source_columns if c not in raw.columns])
+    if 'datetime' not in raw.columns:
+        print("Converting dates to datetime objects...")
+        raw['datetime'] = parse_dates_obs(raw['DATE_OBS'])
+
+    print("Checking data quality rules...")
+    raw, quarantine = apply_rules(raw)
+    raw = raw.copy()
 
     print("Extracting RA and Dec...")
-    raw[['RA','DEC']] = raw['area'].apply(get_centroid)
+    raw[['RA','DEC']] = area_centroids(raw['area'])
 
     print("Dropping excess columns...")
     df = raw[ desired_columns ]
@@ -287,14 +273,65 @@ def setup(data_name='lco/coj_2m0a_2016-02-01_2016-08-01',return_raw=False):
 
     print("Sorting frames by date...")
     df = df.sort_values('datetime').reset_index(drop=True)
+    # The compacted categories are for loading only; callers group the frames
+    # by these columns
+    return uncategorize(df), uncategorize(quarantine)
+
+def setup(data_name='lco/coj_2m0a_2016-02-01_2016-08-01',return_raw=False,
+    use_cache=True,return_quarantine=False):
+    # Returns (frames, blocks, raw frames or None), with the quarantine table
+    # of frames breaking a data quality rule added if return_quarantine
+    # Either a dataset directory (under data/ or data2/), or a dataset name
+    # relative to data2/
+    if os.path.isdir(data_name):
+        data_path = data_name
+    else:
+        data_path = os.path.join("data2", data_name)
+
+    # data_path = os.path.join("data2", "lco", "coj_2m0a_2016-02-01_2016-08-01")
+    if not os.path.isdir(data_path):
+        print("Could not find relative directory '{}'".format(data_path))
+        return
+    if not os.path.isfile(pathjoin(data_path,'_complete')):
+        print("Data at relative directory '{}' does not have '_complete' file".format(
+            data_path))
 
-    print("Extracting science blocks...")
-    block_list = extract_science_blocks(df)
+    # Data exists
+    print("Printing all graphs for data in '{}'...".format(data_name))
 
-    if return_raw:
-        return (df, block_list, raw)
-    else:
-        return (df, block_list, None)
+    if return_raw or not use_cache:
+        print("Loading Dataframe...")
+        raw = merge_datasets(data_path, None if return_raw else source_columns,
+            compact=True)
+        df, quarantine = prepare_frames(raw)
+        print_quarantine(quarantine)
+        print("Extracting science blocks...")
+        block_list = extract_blocks(df)
+        result = (df, block_list, raw if return_raw else None)
+        return result + (quarantine,) if return_quarantine else result
+
+    # Each stage is only recomputed if its input data or code has changed
+    print("Checking stage cache...")
+    frames_key = stage_key('frames', dataset_checksum(data_path),
+        code_version(frame_loader, frame_store, frame_schema, frame_transforms,
+            quality_rules, prepare_frames, reduce_frames, fill_empty_proposal),
+        repr(source_columns), repr(desired_columns))
+    def load_and_prepare():
+        print("Loading Dataframe...")
+        return prepare_frames(merge_datasets(data_path, source_columns,
+            compact=True))
+    df, quarantine = cached_stage(frames_key, load_and_prepare)
+    print_quarantine(quarantine)
+
+    blocks_key = stage_key('blocks', frames_key,
+        code_version(block_extraction, patterns))
+    def extract():
+        print("Extracting science blocks...")
+        return extract_blocks(df)
+    block_list = cached_stage(blocks_key, extract)
+
+    return (df, block_list, None, quarantine) if return_quarantine else \
+        (df, block_list, None)
 
 if __name__ == '__main__':
     df, bl, raw = setup(return_raw=True)
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import pickle
+import pandas as pd
+from os.path import join as pathjoin
+from frame_loader import read_datafile, observation_times, load_frames
+from frame_store import datafile_list, compact_frame_table
+from quality_rules import print_quarantine
+from block_extraction import extract_blocks
+from get_dataframe_lco_default import prepare_frames, source_columns
+
+BLOCK_STORE_DIR = "block_store"
+BLOCKS_NAME = "blocks.pkl"
+MARKS_NAME = "_high_water.json"
+# The longest a block's frames can be spread over. Frames of a block with new
+# frames are searched for this far either side of the new frames.
+BLOCK_SPAN = pd.Timedelta(days=1)
+
+
+def chunk_number(filename):
+    return int(filename.split('_')[-1].split('.')[0])
+
+
+class BlockStore():
+    """
+    The science blocks (see extract_blocks) of a set of datasets, kept up to
+    date as datafile chunks are added to them without recomputing every
+    block. Alongside the block table ('blocks.pkl') is a high-water mark for
+    each dataset ('_high_water.json'):
+        {"file_index", "size", "mtime_ns", "start", "end"}
+    giving the last datafile chunk the blocks were computed from (with its
+    size and modification time, in case it has since been rewritten) and the
+    range of observation times of the dataset's frames.
+
+    Chunks past a dataset's mark are new. Only the blocks with frames in new
+    chunks are recomputed, from their frames in every dataset of the store,
+    which are found by loading only the frames within BLOCK_SPAN of the new
+    frames. Chunks before the mark are assumed unchanged, as downloads only
+    add chunks.
+    """
+
+    def __init__(self, dir_path=BLOCK_STORE_DIR):
+        self.dir_path = dir_path
+        self.blocks = pd.DataFrame([])
+        self.marks = {}
+
+    @classmethod
+    def load(cls, dir_path=BLOCK_STORE_DIR):
+        store = cls(dir_path)
+        blocks_path = pathjoin(dir_path, BLOCKS_NAME)
+        marks_path = pathjoin(dir_path, MARKS_NAME)
+        if os.path.isfile(blocks_path) and os.path.isfile(marks_path):
+            with open(blocks_path, "rb") as f:
+                store.blocks = pickle.load(f)
+            with open(marks_path, "r") as f:
+                store.marks = json.load(f)
+        return store
+
+    def save(self):
+        # The blocks are saved before the marks, so that an interrupted save
+        # only means the newest chunks are processed (again) next time
+        os.makedirs(self.dir_path, exist_ok=True)
+        for name, write, mode in [
+                (BLOCKS_NAME, lambda f: pickle.dump(
+                    self.blocks, f, protocol=pickle.HIGHEST_PROTOCOL), "wb"),
+                (MARKS_NAME, lambda f: json.dump(self.marks, f, indent=1),
+                 "w")]:
+            path = pathjoin(self.dir_path, name)
+            with open(path + ".tmp", mode) as f:
+                write(f)
+            os.replace(path + ".tmp", path)
+
+    def new_chunks(self, dir_path):
+        """The datafile chunks of a dataset past its high-water mark,
+        including the marked chunk itself if it has changed since."""
+        filenames = datafile_list(dir_path)
+        mark = self.marks.get(os.path.normpath(dir_path))
+        if mark is None:
+            return filenames
+
+        new = [f for f in filenames if chunk_number(f) > mark["file_index"]]
+        for filename in filenames:
+            if chunk_number(filename) == mark["file_index"]:
+                stat = os.stat(pathjoin(dir_path, filename))
+                if [stat.st_size, stat.st_mtime_ns] != [mark["size"],
+                                                        mark["mtime_ns"]]:
+                    new.insert(0, filename)
+        return new
+
+    def _mark(self, dir_path, filenames, times):
+        """Move a dataset's high-water mark to the last of its chunks."""
+        key = os.path.normpath(dir_path)
+        mark = self.marks.get(key, {"start": None, "end": None})
+        filename = max(filenames, key=chunk_number)
+        stat = os.stat(pathjoin(dir_path, filename))
+        times = times.dropna()
+        if len(times) > 0:
+            start, end = times.min().isoformat(), times.max().isoformat()
+            mark["start"] = min(mark["start"] or start, start)
+            mark["end"] = max(mark["end"] or end, end)
+        mark.update(file_index=chunk_number(filename), size=stat.st_size,
+                    mtime_ns=stat.st_mtime_ns)
+        self.marks[key] = mark
+
+    def _overlaps(self, dir_path, start, end):
+        mark = self.marks.get(os.path.normpath(dir_path))
+        return mark is not None and mark["start"] is not None and \
+            pd.Timestamp(mark["start"]) < end and \
+            pd.Timestamp(mark["end"]) >= start
+
+    def update(self, dataset_paths, verbose=True):
+        """
+        Bring the blocks up to date with the datafile chunks of the given
+        datasets (which join the store if they are not in it already),
+        recomputing only the blocks with frames in new chunks, and save the
+        store. Returns the block table.
+        """
+        new_chunks = {os.path.normpath(d): self.new_chunks(d)
+                      for d in dataset_paths}
+        new_chunks = {d: f for d, f in new_chunks.items() if len(f) > 0}
+        if len(new_chunks) == 0:
+            if verbose:
+                print("Block store is up to date")
+            return self.blocks
+
+        # The blocks with frames in the new chunks, and when those frames are
+        new_frames = {dir_path: pd.concat([
+            read_datafile(pathjoin(dir_path, filename), ['DATE_OBS', 'BLKUID'])
+            for filename in filenames], ignore_index=True)
+            for dir_path, filenames in new_chunks.items()}
+        new_times = {dir_path: observation_times(frames)
+                     if 'DATE_OBS' in frames
+                     else pd.Series([], dtype='datetime64[ns]')
+                     for dir_path, frames in new_frames.items()}
+        blkuids = pd.concat([frames['BLKUID'] for frames in new_frames.values()
+                             if 'BLKUID' in frames]).dropna().unique() \
+            if any('BLKUID' in f for f in new_frames.values()) else []
+
+        if len(blkuids) > 0:
+            times = pd.concat(list(new_times.values())).dropna()
+            start = times.min() - BLOCK_SPAN
+            end = times.max() + BLOCK_SPAN
+            searched = list(new_chunks) + [d for d in self.marks
+                                           if d not in new_chunks and
+                                           self._overlaps(d, start, end)]
+            frames = pd.concat([load_frames(dir_path, source_columns,
+                                            verbose=False, start=start,
+                                            end=end)
+                                for dir_path in searched], ignore_index=True)
+            # Compacted before the other blocks' frames are dropped, so that
+            # the frames are typed as setup() types them
+            frames = compact_frame_table(frames, False)
+            frames = frames[frames['BLKUID'].isin(blkuids).to_numpy()]
+
+            df, quarantine = prepare_frames(frames)
+            print_quarantine(quarantine)
+            blocks = extract_blocks(df, verbose)
+            if blocks is None:
+                print("Block store not updated")
+                return self.blocks
+
+            # Replace the recomputed blocks, keeping the table in BLKUID order
+            kept = self.blocks
+            if len(kept) > 0:
+                kept = kept[~kept['blkuid'].isin(blkuids)]
+            self.blocks = pd.concat([d for d in [kept, blocks] if len(d) > 0],
+                                    ignore_index=True) \
+                if len(kept) + len(blocks) > 0 else pd.DataFrame([])
+            if len(self.blocks) > 0:
+                self.blocks = self.blocks.sort_values(
+                    'blkuid', kind='stable').reset_index(drop=True)
+
+        for dir_path, filenames in new_chunks.items():
+            self._mark(dir_path, filenames, new_times[dir_path])
+        self.save()
+
+        if verbose:
+            n_chunks = sum(len(f) for f in new_chunks.values())
+            print(f"{n_chunks} new chunks of {len(new_chunks)} datasets: "
+                  f"{len(blkuids)} blocks recomputed, {len(self.blocks)} "
+                  f"in store")
+        return self.blocks
+
+
+def update_blocks(dataset_paths, store_dir=BLOCK_STORE_DIR, verbose=True):
+    """Update the block store in store_dir with the given datasets' new
+    chunks, returning its block table."""
+    return BlockStore.load(store_dir).update(dataset_paths, verbose)
+
+################################################################################
+
+if __name__ == '__main__':
+    # python incremental_blocks.py <dataset directory> ...
+    update_blocks(sys.argv[1:])
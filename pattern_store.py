@@ -0,0 +1,154 @@
+import sys
+import json
+import numpy as np
+import pandas as pd
+from patterns import run_length_encode
+
+COMPACT_SUFFIX = "_rle.json"
+
+
+class PatternStore():
+    """
+    The observation patterns of a set of blocks, and how many blocks followed
+    each, as held in observation_patterns_v2.json. A pattern is a sequence
+    of exposure times, kept run length encoded as a tuple of
+    (exposure time, repeats) runs; patterns are interned, so adding one that
+    is already stored just adds to its count.
+
+    Patterns are drawn in proportion to their counts by a binary search of
+    the cumulative counts, so sampling costs O(log n) per request in the
+    number of stored patterns.
+
+    Saved stores are JSON of:
+        {"exposure_times": [...], "runs": [[[time, repeats], ...], ...],
+         "counts": [...]}
+    where each run gives its exposure time as a position in exposure_times.
+    """
+
+    def __init__(self):
+        self.patterns = []          # Tuples of (exposure time, repeats) runs
+        self.counts = []
+        self._index = {}            # Pattern: its position in self.patterns
+        self._cumulative = None
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def add(self, pattern, count=1):
+        """Add count blocks with a run length encoded pattern, returning the
+        pattern's position in the store."""
+        pattern = tuple((float(time), int(repeats))
+                        for time, repeats in pattern)
+        i = self._index.get(pattern)
+        if i is None:
+            i = len(self.patterns)
+            self._index[pattern] = i
+            self.patterns.append(pattern)
+            self.counts.append(0)
+        self.counts[i] += count
+        self._cumulative = None
+        return i
+
+    def exposures(self, i):
+        """The full list of exposure times of the i'th pattern."""
+        return [time for time, repeats in self.patterns[i]
+                for _ in range(repeats)]
+
+    @classmethod
+    def from_exposure_lists(cls, exposure_lists, counts):
+        """Build a store from patterns given as full lists of exposure times,
+        run length encoding them all together."""
+        store = cls()
+        lengths = np.array([len(e) for e in exposure_lists], dtype=np.int64)
+        times = np.array([t for e in exposure_lists for t in e], dtype=float)
+        pattern_ids = np.repeat(np.arange(len(exposure_lists)), lengths)
+        run_times, run_repeats, run_patterns = run_length_encode(times,
+                                                                 pattern_ids)
+
+        run_counts = np.bincount(run_patterns, minlength=len(exposure_lists))
+        run_starts = np.cumsum(run_counts) - run_counts
+        for start, run_count, count in zip(run_starts, run_counts, counts):
+            store.add(zip(run_times[start:start + run_count],
+                          run_repeats[start:start + run_count]), count)
+        return store
+
+    @classmethod
+    def from_blocks(cls, block_list):
+        """Build a store from the 'pattern' column of a block table, as
+        extracted by extract_blocks, most common pattern first."""
+        frequencies = block_list['pattern'].value_counts(sort=True)
+        exposure_lists = [[float(style[0]) for style, repeats in pattern
+                           for _ in range(repeats)]
+                          for pattern in frequencies.index]
+        return cls.from_exposure_lists(exposure_lists,
+                                       frequencies.tolist())
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved store, or an observation_patterns JSON file of full
+        exposure time lists (its cumulative probabilities are recomputed
+        from the counts)."""
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        if "runs" not in data:
+            entries = [data[key] for key in sorted(data, key=int)]
+            return cls.from_exposure_lists(
+                [entry["pattern"] for entry in entries],
+                [entry["count"] for entry in entries])
+
+        store = cls()
+        exposure_times = data["exposure_times"]
+        for runs, count in zip(data["runs"], data["counts"]):
+            store.add(((exposure_times[time], repeats)
+                       for time, repeats in runs), count)
+        return store
+
+    def save(self, path):
+        exposure_times = sorted({time for pattern in self.patterns
+                                 for time, repeats in pattern})
+        time_index = {time: i for i, time in enumerate(exposure_times)}
+        data = {
+            "exposure_times": exposure_times,
+            "runs": [[[time_index[time], repeats] for time, repeats in pattern]
+                     for pattern in self.patterns],
+            "counts": self.counts
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    def cumulative_probability(self):
+        """The cumulative probability of each pattern, in store order, as
+        listed in the observation_patterns files."""
+        return np.cumsum(self.counts) / sum(self.counts)
+
+    def sample(self, size, rng=None):
+        """
+        Draw the positions of size patterns, each in proportion to its count.
+            rng - a numpy Generator or seed, for reproducible samples
+        """
+        if self._cumulative is None:
+            self._cumulative = np.cumsum(self.counts, dtype=np.int64)
+        rng = np.random.default_rng(rng)
+        draws = rng.integers(0, self._cumulative[-1], size=size)
+        return np.searchsorted(self._cumulative, draws, side='right')
+
+    def summary(self):
+        """A DataFrame of every pattern's count, number of exposures and
+        total exposure time in seconds."""
+        return pd.DataFrame({
+            'count': self.counts,
+            'num_exposures': [sum(r for t, r in p) for p in self.patterns],
+            'exposure_sum': [sum(t * r for t, r in p) for p in self.patterns]
+        })
+
+################################################################################
+
+if __name__ == '__main__':
+    # Convert observation_patterns files into compact pattern stores
+    for path in sys.argv[1:]:
+        store = PatternStore.load(path)
+        compact_path = path.rsplit(".json", 1)[0] + COMPACT_SUFFIX
+        store.save(compact_path)
+        print(f"{path} - {len(store)} patterns of {sum(store.counts)} blocks "
+              f"saved to {compact_path}")
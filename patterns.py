@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+# The frame properties that make up an exposure pattern, in the order they
+# appear in a pattern's styles
+STYLE_COLUMNS = ['EXPTIME', 'INSTRUME', 'FILTER', 'OBSTYPE']
+
+
+def style_codes(frames):
+    """
+    Give every frame an integer code for its (EXPTIME, INSTRUME, FILTER,
+    OBSTYPE) style. Returns the code of every row and the list of styles as
+    tuples, indexed by code. Missing values count as equal to each other.
+    """
+    if len(frames) == 0:
+        return np.array([], dtype=np.int64), []
+    combined = np.zeros(len(frames), dtype=np.int64)
+    for column in STYLE_COLUMNS:
+        codes, uniques = pd.factorize(frames[column].to_numpy(),
+                                      use_na_sentinel=False)
+        combined = combined * len(uniques) + codes
+    unique, first_rows, codes = np.unique(combined, return_index=True,
+                                          return_inverse=True)
+    # Styles hold the frames' own Python values, as get_pattern would give
+    values = [frames[column].iloc[first_rows].tolist()
+              for column in STYLE_COLUMNS]
+    return codes.ravel(), list(zip(*values))
+
+
+def run_length_encode(codes, block_ids):
+    """
+    Run length encode the codes of rows sorted by block, without a run ever
+    crossing from one block into the next. Returns the code, length and
+    block of every run.
+    """
+    if len(codes) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    boundaries = np.flatnonzero((codes[1:] != codes[:-1]) |
+                                (block_ids[1:] != block_ids[:-1])) + 1
+    run_starts = np.concatenate([[0], boundaries])
+    run_lengths = np.diff(np.concatenate([run_starts, [len(codes)]]))
+    return codes[run_starts], run_lengths, block_ids[run_starts]
+
+
+def encode_patterns(frames, block_ids, n_blocks):
+    """
+    The exposure pattern of every block of a frame table sorted by block and
+    then by time, as given by condense_pattern(get_pattern(block)) for each
+    block. Returns a pattern ID for every block and the lookup table of
+    patterns indexed by ID.
+
+    Blocks with the same number of runs are compared together as the rows
+    of one (blocks, runs) array, so patterns are numbered without building
+    one per block; only the distinct patterns are built as tuples.
+    """
+    codes, styles = style_codes(frames)
+    run_codes, run_lengths, run_blocks = run_length_encode(codes, block_ids)
+    run_counts = np.bincount(run_blocks, minlength=n_blocks)
+    run_starts = np.cumsum(run_counts) - run_counts
+
+    pattern_ids = np.zeros(n_blocks, dtype=np.int64)
+    lookup = []
+    for count in np.unique(run_counts):
+        blocks = np.flatnonzero(run_counts == count)
+        runs = run_starts[blocks][:, None] + np.arange(count)
+        keys = np.concatenate([run_codes[runs], run_lengths[runs]], axis=1)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        pattern_ids[blocks] = len(lookup) + inverse.ravel()
+        lookup += [tuple((styles[code], int(length)) for code, length in
+                         zip(key[:count], key[count:]))
+                   for key in unique_keys]
+    return pattern_ids, lookup
+
+
+def pattern_frequencies(block_list, by='propid'):
+    """
+    The number of blocks with each pattern in every group of a block table
+    (by default each proposal), as a DataFrame of by, pattern and count
+    sorted by group and then most common pattern first.
+    """
+    pattern_ids, lookup = pd.factorize(block_list['pattern'].to_numpy())
+    counts = pd.DataFrame({by: block_list[by].to_numpy(),
+                           'pattern_id': pattern_ids}) \
+        .groupby([by, 'pattern_id']).size().rename('count').reset_index()
+    counts = counts.sort_values([by, 'count'], ascending=[True, False],
+                                kind='stable')
+    counts['pattern'] = lookup[counts['pattern_id']]
+    return counts[[by, 'pattern', 'count']].reset_index(drop=True)
@@ -1,6 +1,7 @@
 import plotly.offline as py
 import plotly.graph_objs as go
 from get_dataframe_lco_default import *
+from patterns import pattern_frequencies
 import datetime, re
 from numpy import log10, finfo
 from os.path import join as pathjoin
@@ -11,13 +12,11 @@ from os.path import join as pathjoin
 
 ## Patterns by Proposal
 def print_proposal_patterns(block_list):
-    for propid, group in block_list.groupby('propid'):
+    frequencies = pattern_frequencies(block_list, by='propid')
+    for propid, group in frequencies.groupby('propid', sort=False):
         print propid
-        pattern_list = []
-        for pattern, g2 in group.groupby('pattern'):
-            pattern_list.append( [len(g2),pattern] )
-        for p in sorted(pattern_list,key=lambda x: x[0],reverse=True):
-            print p[0], p[1]
+        for count, pattern in zip(group['count'], group['pattern']):
+            print count, pattern
         print ""
 
 
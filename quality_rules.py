@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from block_extraction import SCIENCE_PROPID_PATTERN
+
+# The data quality rules frames are checked against as they are loaded. Each
+# rule has a name and one of these checks:
+#     not_null - 'column' must have a value
+#     minimum - 'column' must not be below 'min'
+#     homogeneous - frames sharing 'key' must hold one value (missing values
+#         counting as a value) of each of 'columns'
+# A rule only applies to frames matching every regex of its optional 'where'
+# ({column: pattern}) and none of the values of its optional 'exclude'
+# ({column: [values]}). Rules must not depend on the order frames are loaded
+# in, which differs between downloads (sharded downloads are merged oldest
+# first) and between sets of datasets loaded together.
+RULES = [
+    {'name': 'valid_date', 'check': 'not_null', 'column': 'datetime'},
+    {'name': 'non_negative_exptime', 'check': 'minimum', 'column': 'EXPTIME',
+     'min': 0},
+    {'name': 'single_propid_per_block', 'check': 'homogeneous',
+     'key': 'BLKUID', 'columns': ['PROPID'],
+     'where': {'PROPID': SCIENCE_PROPID_PATTERN}},
+    {'name': 'single_propid_per_request', 'check': 'homogeneous',
+     'key': 'REQNUM', 'columns': ['PROPID']},
+    {'name': 'homogeneous_exposure', 'check': 'homogeneous',
+     'key': ['REQNUM', 'datetime'],
+     'columns': ['EXPTIME', 'FILTER', 'INSTRUME', 'OBJECT', 'OBSTYPE'],
+     'exclude': {'OBSTYPE': ['CATALOG']}},
+]
+
+
+def rule_columns(rule):
+    """Every column a rule reads."""
+    columns = [rule['column']] if 'column' in rule else []
+    columns += list(rule.get('columns', []))
+    key = rule.get('key', [])
+    columns += [key] if isinstance(key, str) else list(key)
+    return columns + list(rule.get('where', {})) + list(rule.get('exclude', {}))
+
+
+def applies_to(df, rule):
+    """The frames a rule applies to."""
+    mask = np.ones(len(df), dtype=bool)
+    for column, pattern in rule.get('where', {}).items():
+        mask &= df[column].astype(str).str.match(pattern).to_numpy(dtype=bool)
+    for column, values in rule.get('exclude', {}).items():
+        mask &= ~df[column].isin(values).to_numpy()
+    return mask
+
+
+def _not_null(df, rule):
+    return df[rule['column']].isna().to_numpy()
+
+
+def _minimum(df, rule):
+    values = pd.to_numeric(df[rule['column']], errors='coerce')
+    return (values < rule['min']).to_numpy()
+
+
+def _homogeneous(df, rule):
+    keys = rule['key'] if isinstance(rule['key'], list) else [rule['key']]
+    # Frames missing a key belong to no group, as with groupby
+    keyed = df[keys].notna().all(axis=1).to_numpy()
+    failed = np.zeros(len(df), dtype=bool)
+    if not keyed.any():
+        return failed
+
+    # Compare integer codes, so that missing values count as a value
+    codes = pd.DataFrame({column: pd.factorize(df[column].to_numpy()[keyed],
+                                               use_na_sentinel=False)[0]
+                          for column in rule['columns']})
+    groups = [df[key].to_numpy()[keyed] for key in keys]
+    counts = codes.groupby(groups, sort=False, observed=True).transform(
+        'nunique')
+    failed[keyed] = (counts > 1).any(axis=1).to_numpy()
+    return failed
+
+
+CHECKS = {
+    'not_null': _not_null,
+    'minimum': _minimum,
+    'homogeneous': _homogeneous,
+}
+
+
+def apply_rules(df, rules=RULES):
+    """
+    Check every frame of a table against the rules. Returns the frames that
+    pass them all and a quarantine table of those that don't, with a 'rule'
+    column naming the rules they broke (comma separated). Rules needing a
+    column the table lacks are skipped.
+    """
+    broken = pd.Series('', index=df.index)
+    for rule in rules:
+        if not set(rule_columns(rule)).issubset(df.columns):
+            continue
+        applicable = applies_to(df, rule)
+        failed = np.zeros(len(df), dtype=bool)
+        failed[applicable] = CHECKS[rule['check']](df[applicable], rule)
+        broken[failed] = broken[failed] + rule['name'] + ','
+
+    quarantined = (broken != '').to_numpy()
+    quarantine = df[quarantined].assign(rule=broken[quarantined].str[:-1])
+    return df[~quarantined], quarantine
+
+
+def quarantine_summary(quarantine):
+    """The number of quarantined frames breaking each rule."""
+    if len(quarantine) == 0:
+        return pd.Series(dtype=int)
+    return quarantine['rule'].str.split(',').explode().value_counts()
+
+
+def print_quarantine(quarantine):
+    if len(quarantine) == 0:
+        return
+    print(f"{len(quarantine)} frames quarantined:")
+    for rule, count in quarantine_summary(quarantine).items():
+        print(f"  {rule}: {count}")
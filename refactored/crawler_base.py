@@ -4,11 +4,15 @@ import sys
 import time
 import json
 import shared_functions as sf
+from retry_policy import RetryPolicy
 from requests.exceptions import ReadTimeout
 from OpenSSL.SSL import WantReadError
 from urllib3.exceptions import ReadTimeoutError, MaxRetryError
 from requests.exceptions import ConnectionError
 
+# Seconds to wait before each retry of a timed-out search
+SEARCH_RETRY_DELAYS = [0.01, 0.1, 1, 5, 10]
+
 
 class CrawlerBase():
     def __init__(self, dirname, items_per_file=10000, count_threshold=100,
@@ -43,6 +47,15 @@ class CrawlerBase():
         self.estimate_time = estimate_time   # Whether to include an ETA
         # Crawling Artist IDs cannot have an ETA as we don't know how many there
         # will be.
+
+        # Retry timed-out searches after increasing waits, up to 10s apart
+        # (16.11s in all)
+        self.retry_policy = RetryPolicy(delays=SEARCH_RETRY_DELAYS,
+                                        retry_exceptions=(WantReadError,
+                                                          ReadTimeout,
+                                                          ReadTimeoutError,
+                                                          ConnectionError),
+                                        on_retry=self.log_retry)
         
         # Attempt to load the Saved, Searched, and Unsearched data
         self.load_saved_data()
@@ -252,31 +265,22 @@ class CrawlerBase():
         self.unsearched_items.difference_update(items_searched)
 
 
-    def search_items(self, items_to_search):
-        sleep_times = [0, 0.01, 0.1, 1, 5, 10]
-        success = False
+    def log_retry(self, attempt, delay, error):
+        self.log(f"Timeout ({round(delay, 2)}): {error}")
 
-        for t in sleep_times:
-            time.sleep(t)
-            try:
-                results = self.make_search_request(items_to_search)
-                success = True
-                break
 
-            except (WantReadError, ReadTimeout,
-                    ReadTimeoutError, ConnectionError) as e:
-                log_message = f"Timeout ({t}): {e}"
-                self.log(log_message)
-                continue
-
-        if not success:
+    def search_items(self, items_to_search):
+        try:
+            results = self.retry_policy.call(self.make_search_request,
+                                             items_to_search)
+        except (WantReadError, ReadTimeout,
+                ReadTimeoutError, ConnectionError):
             print("")
             print(f"\n{items_to_search}")
             print("Could not process request even after 10s wait.")
             raise
 
-        else:
-            return self.process_search_results(items_to_search, results)
+        return self.process_search_results(items_to_search, results)
 
 
     # def check_individual_items(self, items_to_reject):
@@ -310,6 +314,7 @@ class CrawlerBase():
                 metrics["new_items"],
                 round(metrics["item_rate"], 1)
             ))
+            print("Retries: {}".format(self.retry_policy.stats.summary()))
             print("\n-Total-")
 
         if self.estimate_time:
@@ -1,5 +1,6 @@
-import requests, sys, json, os, datetime
+import sys, json, os, datetime
 import urllib
+import archive_session
 # from urllib import urlencode
 from os.path import dirname, abspath
 from os.path import join as pathjoin
@@ -88,7 +89,7 @@ def download_data(param_dict,ask_permission=True):
     url = url_base + encoded_params
 
     # Initial Request to check success and entry number
-    r = requests.get(url=url)
+    r = archive_session.get_session().get(url)
     if r.status_code != 200:
         print("Request Failed. Status Code: {}; Reason: {}".format(\
             r.status_code, r.reason))
@@ -137,7 +138,7 @@ def download_data(param_dict,ask_permission=True):
         next_url = request_data['next']
         counter += request_limit
 
-        r = requests.get(url=next_url)
+        r = archive_session.get_session().get(next_url)
         if r.status_code != 200:
             print("Request Failed. Status Code: {}; Reason: {}".format(\
                 r.status_code, r.reason))
@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from chunk_writer import ChunkWriter
+from pattern_store import PatternStore
+
+REQUEST_FILE_BASE = "requests_{}.json"
+REQUESTS_PER_FILE = 100000
+CHUNK_SIZE = 100000
+ACCEPTABILITY_THRESHOLD = 90.0
+DEFAULT_PATTERNS = "observation_patterns_v2.json"
+
+
+def block_sample_table(block_list):
+    """
+    The properties of observed science blocks that synthetic requests are
+    drawn from: proposal, position in degrees and the overhead (time not
+    spent exposing) per exposure. Blocks without a position are left out.
+    """
+    blocks = block_list[block_list['mean_ra'].notna() &
+                        block_list['mean_dec'].notna()]
+    overhead = (blocks['duration'] - blocks['exposure_sum']) / \
+        blocks['num_exposures']
+    return pd.DataFrame({
+        'propid': blocks['propid'].astype(str).to_numpy(),
+        'ra': blocks['mean_ra'].to_numpy(dtype=float) * 15.,  # Hours to deg
+        'dec': blocks['mean_dec'].to_numpy(dtype=float),
+        'overhead': overhead.clip(lower=0).fillna(0).to_numpy(dtype=float)
+    })
+
+
+def sample_requests(blocks, patterns, size, start, end, rng, first_id=0):
+    """
+    Draw size synthetic requests as a DataFrame of id, propid, ra, dec,
+    pattern (position in the pattern store), duration in seconds and the
+    start and end of the request's window.
+
+    Each request takes its exposure pattern from the pattern store, in
+    proportion to how often the pattern was observed, and its proposal,
+    position and per-exposure overhead from an observed block, with every
+    block equally likely. Window starts are uniform between start and end.
+    """
+    summary = patterns.summary()
+    pattern = patterns.sample(size, rng)
+    block = rng.integers(0, len(blocks), size=size)
+
+    overhead = blocks['overhead'].to_numpy()[block]
+    duration = summary['exposure_sum'].to_numpy()[pattern] + \
+        overhead * summary['num_exposures'].to_numpy()[pattern]
+
+    start_s = pd.Timestamp(start).value // 10**9
+    end_s = pd.Timestamp(end).value // 10**9
+    window_start = rng.integers(start_s, end_s, size=size)
+    window_end = window_start + np.ceil(duration).astype(np.int64)
+
+    return pd.DataFrame({
+        'id': np.arange(first_id, first_id + size),
+        'propid': blocks['propid'].to_numpy()[block],
+        'ra': blocks['ra'].to_numpy()[block],
+        'dec': blocks['dec'].to_numpy()[block],
+        'pattern': pattern,
+        'duration': duration,
+        'start': window_start.astype('datetime64[s]'),
+        'end': window_end.astype('datetime64[s]')
+    })
+
+
+def pattern_configurations(patterns):
+    """The 'configurations' entry of a request record for every pattern of
+    a store, with one instrument config per run of exposures."""
+    return [[{
+        "type": "EXPOSE",
+        "instrument_configs": [{"exposure_count": repeats,
+                                "exposure_time": exposure_time}
+                               for exposure_time, repeats in pattern],
+        "repeat_duration": None,
+        "state": "PENDING",
+        "summary": {"end": None, "start": None, "time_completed": None}
+    }] for pattern in patterns.patterns]
+
+
+def request_records(requests, configurations):
+    """Turn sampled requests into records in the style of the request
+    entries of sd3.json, with a target and proposal added."""
+    starts = np.datetime_as_string(requests['start'].to_numpy(), unit='s')
+    ends = np.datetime_as_string(requests['end'].to_numpy(), unit='s')
+    return [{
+        "acceptability_threshold": ACCEPTABILITY_THRESHOLD,
+        "configurations": configurations[pattern],
+        "duration": round(duration, 3),
+        "end": end + "Z",
+        "id": request_id,
+        "is_calibrate": False,
+        "proposal": propid,
+        "request_group_id": request_id,
+        "start": start + "Z",
+        "state": "PENDING",
+        "target": {"ra": round(ra, 6), "dec": round(dec, 6)}
+    } for request_id, propid, ra, dec, pattern, duration, start, end in zip(
+        requests['id'].tolist(), requests['propid'].tolist(),
+        requests['ra'].tolist(), requests['dec'].tolist(),
+        requests['pattern'].tolist(), requests['duration'].tolist(),
+        starts, ends)]
+
+
+def generate_requests(dir_path, block_list, patterns, count, start, end,
+                      seed=None, chunk_size=CHUNK_SIZE):
+    """
+    Write count synthetic requests with windows between start and end into
+    JSON chunk files (REQUEST_FILE_BASE) in dir_path, sampling and writing
+    chunk_size requests at a time so memory use does not grow with count.
+    The same seed and chunk_size always give the same requests.
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    blocks = block_sample_table(block_list)
+    configurations = pattern_configurations(patterns)
+
+    writer = ChunkWriter(dir_path, REQUEST_FILE_BASE, REQUESTS_PER_FILE)
+    sample_time = 0.0
+    start_time = time.perf_counter()
+    for first_id in range(0, count, chunk_size):
+        size = min(chunk_size, count - first_id)
+        sample_start = time.perf_counter()
+        requests = sample_requests(blocks, patterns, size, start, end, rng,
+                                   first_id)
+        sample_time += time.perf_counter() - sample_start
+        writer.write_page(request_records(requests, configurations))
+    writer.close()
+
+    total_time = time.perf_counter() - start_time
+    print(f"{count} requests written to {dir_path} in {total_time:.2f}s "
+          f"({count / max(sample_time, 1e-9):.3g} sampled per second)")
+
+################################################################################
+
+def parse_args(cl_args):
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic requests from archive science blocks.")
+    parser.add_argument("datasets", nargs="+",
+                        help="Datasets (as given to setup()) to draw blocks from.")
+    parser.add_argument("-n", "--count", type=int, default=1000000,
+                        help="Number of requests to generate.")
+    parser.add_argument("-p", "--patterns", default=DEFAULT_PATTERNS,
+                        help="""Pattern store or observation_patterns file.
+                        'blocks' uses the patterns of the datasets' blocks.""")
+    parser.add_argument("-s", "--start", default="2024-01-01",
+                        help="Earliest request window start.")
+    parser.add_argument("-e", "--end", default="2024-02-01",
+                        help="Latest request window start.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed, for a reproducible request stream.")
+    parser.add_argument("-o", "--output", default="synthetic_requests",
+                        help="Directory to write the request files to.")
+    return parser.parse_args(cl_args)
+
+
+if __name__ == '__main__':
+    from get_dataframe_lco_default import setup
+
+    args = parse_args(sys.argv[1:])
+    block_list = pd.concat([setup(d)[1] for d in args.datasets],
+                           ignore_index=True)
+    if args.patterns == 'blocks':
+        patterns = PatternStore.from_blocks(block_list)
+    else:
+        patterns = PatternStore.load(args.patterns)
+    generate_requests(args.output, block_list, patterns, args.count,
+                      args.start, args.end, args.seed)
@@ -0,0 +1,256 @@
+import time
+import random
+import datetime
+import threading
+from email.utils import parsedate_to_datetime
+from requests.exceptions import ConnectionError, Timeout
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while the circuit breaker is open."""
+    pass
+
+
+class RetryStats():
+    """Thread-safe counters of the calls, retries and time spent waiting made
+    through a RetryPolicy. Pass one to RetryPolicy.call per dataset (or per
+    crawler) to keep separate statistics while sharing the policy."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_time = 0.0    # Seconds waiting on the rate limiter
+        self.backoff_time = 0.0      # Seconds sleeping between retries
+
+    def add(self, calls=0, retries=0, failures=0, throttled_time=0.0,
+            backoff_time=0.0):
+        with self._lock:
+            self.calls += calls
+            self.retries += retries
+            self.failures += failures
+            self.throttled_time += throttled_time
+            self.backoff_time += backoff_time
+
+    def summary(self):
+        return "{} requests, {} retries, {} failures, {:.1f}s throttled, " \
+               "{:.1f}s backing off".format(self.calls, self.retries,
+                                            self.failures, self.throttled_time,
+                                            self.backoff_time)
+
+
+class TokenBucket():
+    """
+    A thread-safe token bucket allowing 'rate' calls per second on average,
+    with bursts of up to 'capacity' calls.
+
+    The rate adapts to the server: throttle() halves it (down to min_rate)
+    whenever the server pushes back, and recover() raises it by a small step
+    (up to max_rate) after each success, so it settles just under the highest
+    rate the server tolerates.
+
+    If unlimited, calls are not limited at all until the server first pushes
+    back, from when they are limited to 'rate'.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=None, max_rate=None,
+                 recovery_step=None, unlimited=False):
+        self.unlimited = unlimited
+        self.max_rate = max_rate if max_rate is not None else rate
+        self.min_rate = min_rate if min_rate is not None else rate / 20.
+        self.recovery_step = recovery_step if recovery_step is not None \
+            else self.max_rate / 50.
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    def acquire(self):
+        """Take a token, sleeping until one is available. Returns the time
+        spent waiting."""
+        with self._lock:
+            if self.unlimited:
+                return 0.0
+            self._refill()
+            self.tokens -= 1
+            # A negative balance reserves a token from the future
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttle(self):
+        with self._lock:
+            if self.unlimited:
+                # Start limiting, without a burst of saved up tokens
+                self.unlimited = False
+                self.tokens = 0.0
+                self.last_time = time.monotonic()
+                return
+            self.rate = max(self.min_rate, self.rate / 2.)
+
+    def recover(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.recovery_step)
+
+
+class CircuitBreaker():
+    """
+    Stops calls to a failing server. After failure_threshold consecutive
+    failures the circuit opens and calls raise CircuitOpenError for
+    reset_timeout seconds. After that a single trial call is let through: a
+    success closes the circuit again, a failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=10, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(
+                    f"Circuit open after {self.consecutive_failures} "
+                    f"consecutive failures; retry in {remaining:.0f}s")
+            # Half-open: let this call through as a trial, re-opening the
+            # circuit for anyone else until it reports back
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def retry_after_seconds(response):
+    """The delay requested by a response's Retry-After header, given either
+    in seconds or as an HTTP date, or None if there isn't one."""
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max((retry_time - now).total_seconds(), 0.0)
+
+
+class RetryPolicy():
+    """
+    Makes calls with retries, exponential backoff with full jitter, an
+    optional shared rate limiter (TokenBucket) and an optional CircuitBreaker.
+
+    A call is retried if it raises one of retry_exceptions, or if it returns
+    a response whose status_code is in retry_statuses. Responses with a
+    Retry-After header wait at least that long, and throttling statuses slow
+    the rate limiter down. Once max_attempts are used up the last exception
+    is re-raised, or the last failed response is returned for the caller to
+    handle.
+        on_retry - optional callback(attempt, delay, error) called before
+            each retry sleep, where error is the exception or response
+        delays - optional fixed schedule of seconds to sleep before each
+            retry, used instead of the jittered backoff. max_attempts is
+            then one more than the number of delays.
+    """
+
+    def __init__(self, max_attempts=6, base_delay=0.5, max_delay=60,
+                 retry_exceptions=(ConnectionError, Timeout),
+                 retry_statuses=RETRY_STATUSES, rate_limiter=None,
+                 breaker=None, on_retry=None, delays=None):
+        self.delays = list(delays) if delays is not None else None
+        self.max_attempts = max_attempts if delays is None else \
+            len(self.delays) + 1
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_exceptions = retry_exceptions
+        self.retry_statuses = retry_statuses
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker
+        self.on_retry = on_retry
+        self.stats = RetryStats()
+
+    def backoff_delay(self, attempt):
+        if self.delays is not None:
+            return self.delays[min(attempt, len(self.delays) - 1)]
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+    def call(self, fn, *args, stats=None, **kwargs):
+        if stats is None:
+            stats = self.stats
+
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                self.breaker.before_call()
+            if self.rate_limiter is not None:
+                stats.add(throttled_time=self.rate_limiter.acquire())
+            stats.add(calls=1)
+
+            try:
+                result = fn(*args, **kwargs)
+            except self.retry_exceptions as e:
+                error = e
+                delay = self.backoff_delay(attempt)
+            else:
+                status = getattr(result, "status_code", None)
+                if status not in self.retry_statuses:
+                    if self.breaker is not None:
+                        self.breaker.record_success()
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.recover()
+                    return result
+                error = result
+                delay = self.backoff_delay(attempt)
+                retry_after = retry_after_seconds(result)
+                if (status in THROTTLE_STATUSES or retry_after is not None) \
+                        and self.rate_limiter is not None:
+                    self.rate_limiter.throttle()
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+
+            if self.breaker is not None:
+                self.breaker.record_failure()
+
+            if attempt == self.max_attempts - 1:
+                break
+
+            if self.on_retry is not None:
+                self.on_retry(attempt, delay, error)
+            stats.add(retries=1, backoff_time=delay)
+            time.sleep(delay)
+
+        stats.add(failures=1)
+        if isinstance(error, BaseException):
+            raise error
+        return error
@@ -0,0 +1,133 @@
+import os
+import json
+import pickle
+import inspect
+import hashlib
+import numpy as np
+import pandas as pd
+from os.path import join as pathjoin
+from frame_store import datafile_list, store_path
+
+CACHE_DIR = ".stage_cache"
+CACHE_SIZE_LIMIT = 2 * 1024**3         # Bytes of cached results to keep
+CHECKSUM_INDEX = "_checksums.json"
+CACHE_SUFFIX = ".pkl"
+
+
+def file_checksum(path):
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024**2), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def dataset_checksum(dir_path, cache_dir=CACHE_DIR):
+    """
+    A checksum of the contents of a dataset's datafile chunks and frame
+    store. Each file's own checksum is remembered in the cache directory
+    along with its size and modification time, so unchanged files are not
+    read again.
+    """
+    index_path = pathjoin(cache_dir, CHECKSUM_INDEX)
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+    except (OSError, json.decoder.JSONDecodeError):
+        index = {}
+
+    filenames = datafile_list(dir_path)
+    if os.path.isfile(store_path(dir_path)):
+        filenames.append(os.path.basename(store_path(dir_path)))
+
+    changed = False
+    dataset_hash = hashlib.sha256()
+    for filename in filenames:
+        path = os.path.abspath(pathjoin(dir_path, filename))
+        stat = os.stat(path)
+        entry = index.get(path)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            entry = [stat.st_size, stat.st_mtime_ns, file_checksum(path)]
+            index[path] = entry
+            changed = True
+        dataset_hash.update(f"{filename}:{entry[2]}\n".encode())
+
+    if changed:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".tmp", index_path)
+    return dataset_hash.hexdigest()
+
+
+def code_version(*code):
+    """A hash of the source code of the given modules and functions, so
+    that a cached stage is recomputed once its code changes."""
+    code_hash = hashlib.sha256()
+    for obj in code:
+        code_hash.update(inspect.getsource(obj).encode())
+    return code_hash.hexdigest()
+
+
+def stage_key(stage, *parts):
+    """The cache key of a stage's result given the keys of its inputs and
+    the versions of its code. The pandas and numpy versions are included, as
+    results pickled under one may not load under another."""
+    parts = (stage, pd.__version__, np.__version__) + parts
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def cache_entries(cache_dir=CACHE_DIR):
+    """Paths of the cached results, least recently used first."""
+    if not os.path.isdir(cache_dir):
+        return []
+    paths = [pathjoin(cache_dir, f) for f in os.listdir(cache_dir)
+             if f.endswith(CACHE_SUFFIX)]
+    return sorted(paths, key=os.path.getmtime)
+
+
+def evict(size_limit=CACHE_SIZE_LIMIT, cache_dir=CACHE_DIR):
+    """Delete the least recently used results until the cache holds no more
+    than size_limit bytes."""
+    entries = cache_entries(cache_dir)
+    total_size = sum(os.path.getsize(path) for path in entries)
+    for path in entries:
+        if total_size <= size_limit:
+            break
+        total_size -= os.path.getsize(path)
+        os.remove(path)
+
+
+def cached_stage(key, compute, cache_dir=CACHE_DIR,
+                 size_limit=CACHE_SIZE_LIMIT):
+    """
+    Return the cached result of the stage with this key, or compute() it and
+    cache the result. Results are pickled, which keeps DataFrames (and the
+    tuple columns of block tables) intact and loads quickly. Using a result
+    marks it as recently used. A result that fails to load for any reason
+    is recomputed.
+    """
+    path = pathjoin(cache_dir, key + CACHE_SUFFIX)
+    if os.path.isfile(path):
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            os.utime(path)
+            return result
+        except Exception:
+            # Corrupt, or pickled by incompatible library versions
+            pass
+
+    result = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write then rename, so that a partly written result is never loaded
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+    evict(size_limit, cache_dir)
+    return result
+
+
+def clear_cache(cache_dir=CACHE_DIR):
+    for path in cache_entries(cache_dir):
+        os.remove(path)